@@ -0,0 +1,244 @@
+"""Offline benchmark of the forwarding pipeline.
+
+Seeds a SQLite network of guilds, answers Discord requests with `FakeDiscord` and feeds
+generated messages to `Network.forward_medias`, then reports fan-out latency, database
+queries and HTTP calls per message.
+
+Usage:
+    python -m benchmarks.forwarding --guilds 50 --messages 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import discord
+from loguru import logger
+from tortoise import Tortoise, connections
+
+from benchmarks.stub import (
+    FakeDiscord,
+    attachment_payload,
+    channel_payload,
+    guild_payload,
+    message_payload,
+    snowflake,
+    user_payload,
+)
+from wocardo.bot import WocardoBot
+from wocardo.cogs.network import Network
+from wocardo.db.models import Guild
+from wocardo.metrics import METRICS, count_queries
+
+if TYPE_CHECKING:
+    from wocardo.db.models import Delivery
+
+
+class QueryCounter:
+    """Counts the queries sent through the default database connection."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def install(self) -> None:
+        count_queries(connections.get("default"), self._counted)
+
+    def _counted(self) -> None:
+        self.count += 1
+
+
+class SeededNetwork:
+    """The seeded network: one sender guild and a receiver in every other guild."""
+
+    def __init__(self, guilds: int) -> None:
+        self.bot_id = snowflake()
+        self.user = user_payload(snowflake(), "artist")
+        self.source_guild = snowflake()
+        self.sender = snowflake()
+        self.receivers = {snowflake(): snowflake() for _ in range(guilds - 1)}
+
+    async def seed(self) -> None:
+        source = await Guild.create(id=self.source_guild)
+        await source.add_sender(self.sender)
+        await source.add_send_user(int(self.user["id"]))
+        for guild_id, channel_id in self.receivers.items():
+            guild = await Guild.create(id=guild_id)
+            await guild.set_receiver(channel_id, nsfw=False)
+        await Guild.load_routes()
+
+    def add_to(self, bot: discord.Client) -> discord.TextChannel:
+        state = bot._connection
+        source = state._add_guild_from_data(
+            guild_payload(self.source_guild, [channel_payload(self.sender, self.source_guild)])
+        )
+        for guild_id, channel_id in self.receivers.items():
+            state._add_guild_from_data(
+                guild_payload(guild_id, [channel_payload(channel_id, guild_id)])
+            )
+
+        channel = source.get_channel(self.sender)
+        assert isinstance(channel, discord.TextChannel)  # noqa: S101
+        return channel
+
+
+def make_message(
+    bot: discord.Client,
+    fake: FakeDiscord,
+    channel: discord.TextChannel,
+    author: dict[str, Any],
+    rng: random.Random,
+) -> discord.Message:
+    attachments = [
+        attachment_payload(snowflake(), f"image-{i}.png", rng.randint(50_000, 2_000_000))
+        for i in range(rng.randint(1, 3))
+    ]
+    payload = message_payload(snowflake(), channel.id, author, attachments=attachments)
+    fake.add_message(payload)
+    return discord.Message(state=bot._connection, channel=channel, data=payload)  # pyright: ignore[reportArgumentType]
+
+
+def ratelimited() -> int:
+    """Count the 429s discord.py retried, as recorded by the metrics."""
+    counters = METRICS.snapshot()["counters"]
+    return sum(value for name, value in counters.items() if name.startswith("ratelimited"))
+
+
+def percentile(values: list[float], p: int) -> float:
+    if len(values) < 2:  # noqa: PLR2004
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    fake = FakeDiscord(
+        latency=args.latency,
+        cdn_latency=args.cdn_latency,
+        rate_limit_every=args.rate_limit_every,
+        upload_limit=args.upload_limit,
+    )
+    queries = QueryCounter()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await Tortoise.init(
+            db_url=f"sqlite://{Path(tmp) / 'bench.sqlite3'}",
+            modules={"models": ["wocardo.db.models"]},
+        )
+        await Tortoise.generate_schemas()
+        queries.install()
+
+        network = SeededNetwork(args.guilds)
+        await network.seed()
+
+        bot = WocardoBot()
+        await fake.install(bot, user_id=network.bot_id, name="guoba")
+        channel = network.add_to(bot)
+        # setup_hook doesn't run, the routes and caches are loaded here
+        bot.warm.set()
+
+        cog = Network(bot)
+        await bot.add_cog(cog)
+
+        started: dict[int, float] = {}
+        latencies: list[float] = []
+        finished = asyncio.Event()
+        handler = cog.deliveries.handler
+
+        async def timed(delivery: Delivery) -> bool:
+            done = await handler(delivery)
+            if done:
+                now = time.perf_counter()
+                for message_id in (delivery.id, *delivery.merged_ids):
+                    if message_id in started:
+                        latencies.append(now - started.pop(message_id))
+                if not started:
+                    finished.set()
+            return done
+
+        cog.deliveries.handler = timed
+
+        # The first message creates the webhooks, don't count it
+        warmup = make_message(bot, fake, channel, network.user, rng)
+        started[warmup.id] = time.perf_counter()
+        await cog.forward_medias(warmup)
+        await finished.wait()
+        latencies.clear()
+        finished.clear()
+        fake.reset()
+        queries.count = 0
+        # Counts the 429s discord.py retries, like in production
+        METRICS.enable()
+
+        start = time.perf_counter()
+        for _ in range(args.messages):
+            message = make_message(bot, fake, channel, network.user, rng)
+            started[message.id] = time.perf_counter()
+            await cog.forward_medias(message)
+            await asyncio.sleep(args.interval)
+        await finished.wait()
+        elapsed = time.perf_counter() - start
+
+        await bot.remove_cog(cog.qualified_name)
+        await bot.http._HTTPClient__session.close()  # pyright: ignore[reportAttributeAccessIssue]
+        await fake.uninstall()
+        await Tortoise.close_connections()
+
+    report(args, fake, queries, latencies, elapsed)
+
+
+def report(
+    args: argparse.Namespace,
+    fake: FakeDiscord,
+    queries: QueryCounter,
+    latencies: list[float],
+    elapsed: float,
+) -> None:
+    messages = args.messages
+    print(f"guilds: {args.guilds}, messages: {messages}, elapsed: {elapsed:.2f}s")
+    print(
+        f"fan-out latency p50: {percentile(latencies, 50):.3f}s, "
+        f"p99: {percentile(latencies, 99):.3f}s"
+    )
+    print(f"db queries / message: {queries.count / messages:.1f}")
+    print(
+        f"http calls / message: {fake.total_calls / messages:.1f} "
+        f"(429: {fake.rate_limited}, retried: {ratelimited()}, 40005: {fake.too_large})"
+    )
+    for route, count in fake.calls.most_common():
+        print(f"  {route}: {count / messages:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--guilds", type=int, default=20, help="number of guilds in the network")
+    parser.add_argument("--messages", type=int, default=50, help="number of messages to forward")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between messages")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per HTTP request")
+    parser.add_argument("--cdn-latency", type=float, default=0.05, help="seconds per download")
+    parser.add_argument(
+        "--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429"
+    )
+    parser.add_argument(
+        "--upload-limit",
+        type=int,
+        default=100 * 1024 * 1024,
+        help="bytes over which uploads fail with 40005",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
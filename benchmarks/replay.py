@@ -0,0 +1,284 @@
+"""Replay a recorded gateway trace against the network cog.
+
+Feeds the events recorded with `TRACE_FILE` to the `Network` cog, with Discord answered
+by `FakeDiscord` and a scratch SQLite database, then reports throughput, the latency of
+each handler and the fan-out latency of the forwarded messages.
+
+The network is seeded from a routes snapshot if one is given. Otherwise every channel
+the trace has attachments in becomes a sender, with its authors as send users, and
+forwards to `--guilds` generated receivers. Reactions refer to the copies made by the
+recorded run, so they only exercise the link lookup.
+
+Usage:
+    python -m benchmarks.replay trace.jsonl.gz --speed 0
+    python -m benchmarks.replay trace.jsonl --routes routes_snapshot.json --speed 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import discord
+from loguru import logger
+from tortoise import Tortoise
+
+from benchmarks.forwarding import QueryCounter, percentile
+from benchmarks.stub import (
+    FakeDiscord,
+    attachment_payload,
+    channel_payload,
+    guild_payload,
+    snowflake,
+)
+from wocardo.bot import WocardoBot
+from wocardo.cogs.network import Network
+from wocardo.db.models import Guild
+from wocardo.db.routing import GuildRoute, RoutingTable
+from wocardo.trace import read_trace
+
+if TYPE_CHECKING:
+    from collections.abc import Coroutine
+
+    from wocardo.db.models import Delivery
+
+
+def routes_from_trace(
+    events: list[tuple[str, float, dict[str, Any]]], receivers: int
+) -> dict[int, GuildRoute]:
+    routes: dict[int, GuildRoute] = {}
+    for event, _, data in events:
+        if event != "MESSAGE_CREATE" or not data.get("attachments") or "guild_id" not in data:
+            continue
+        route = routes.setdefault(int(data["guild_id"]), GuildRoute())
+        route.senders.add(int(data["channel_id"]))
+        if not data["author"].get("bot"):
+            route.send_users.add(int(data["author"]["id"]))
+
+    for _ in range(receivers):
+        routes[snowflake()] = GuildRoute(regular_receiver=snowflake(), nsfw_receiver=snowflake())
+    return routes
+
+
+async def seed(routes: dict[int, GuildRoute]) -> None:
+    for guild_id, route in routes.items():
+        guild = await Guild.create(id=guild_id)
+        for channel_id in route.senders:
+            await guild.add_sender(channel_id)
+        for user_id in route.send_users:
+            await guild.add_send_user(user_id)
+        if route.regular_receiver is not None:
+            await guild.set_receiver(route.regular_receiver, nsfw=False)
+        if route.nsfw_receiver is not None:
+            await guild.set_receiver(route.nsfw_receiver, nsfw=True)
+    await Guild.load_routes()
+
+
+def add_guilds(bot: discord.Client, routes: dict[int, GuildRoute]) -> None:
+    state = bot._connection
+    for guild_id, route in routes.items():
+        channels = [channel_payload(channel_id, guild_id) for channel_id in route.senders]
+        if route.regular_receiver is not None:
+            channels.append(channel_payload(route.regular_receiver, guild_id))
+        if route.nsfw_receiver is not None:
+            channels.append(channel_payload(route.nsfw_receiver, guild_id, nsfw=True))
+        state._add_guild_from_data(guild_payload(guild_id, channels))  # pyright: ignore[reportArgumentType]
+
+
+class Replay:
+    """Turns trace entries into calls of the cog's handlers and times them."""
+
+    def __init__(self, bot: discord.Client, cog: Network, fake: FakeDiscord) -> None:
+        self.bot = bot
+        self.cog = cog
+        self.fake = fake
+        self.handler_latencies: defaultdict[str, list[float]] = defaultdict(list)
+        self.fan_out_latencies: list[float] = []
+        self.delivering = 0
+        self._dispatched: dict[int, float] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+
+        handler = cog.deliveries.handler
+
+        async def timed(delivery: Delivery) -> bool:
+            self.delivering += 1
+            try:
+                done = await handler(delivery)
+            finally:
+                self.delivering -= 1
+            if done:
+                now = time.perf_counter()
+                for message_id in (delivery.id, *delivery.merged_ids):
+                    if message_id in self._dispatched:
+                        self.fan_out_latencies.append(now - self._dispatched.pop(message_id))
+            return done
+
+        cog.deliveries.handler = timed
+
+    def _handle(self, event: str, data: dict[str, Any]) -> Coroutine[Any, Any, None] | None:
+        state = self.bot._connection
+        if event == "MESSAGE_CREATE":
+            # Downloads are answered by the fake CDN, which needs the size in the URL
+            data["attachments"] = [
+                attachment_payload(int(a["id"]), a["filename"], a["size"])
+                for a in data.get("attachments", [])
+            ]
+            self.fake.add_message(data)
+            channel_id = int(data["channel_id"])
+            guild_id = int(data["guild_id"]) if "guild_id" in data else None
+            channel = self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(
+                channel_id, guild_id=guild_id
+            )
+            message = discord.Message(state=state, channel=channel, data=data)  # pyright: ignore[reportArgumentType]
+            self._dispatched[message.id] = time.perf_counter()
+            return self.cog.forward_medias(message)
+        if event == "MESSAGE_DELETE":
+            return self.cog.delete_message_links(discord.RawMessageDeleteEvent(data))  # pyright: ignore[reportArgumentType]
+        if event == "MESSAGE_REACTION_ADD":
+            emoji = discord.PartialEmoji.from_dict(data["emoji"])
+            raw = discord.RawReactionActionEvent(data, emoji, "REACTION_ADD")  # pyright: ignore[reportArgumentType]
+            return self.cog.delete_message_on_reaction(raw)
+        return None
+
+    def dispatch(self, event: str, data: dict[str, Any]) -> None:
+        coro = self._handle(event, data)
+        if coro is None:
+            return
+
+        async def timed() -> None:
+            start = time.perf_counter()
+            try:
+                await coro
+            except Exception:
+                logger.exception(f"Failed to handle {event}")
+            self.handler_latencies[event].append(time.perf_counter() - start)
+
+        task = asyncio.create_task(timed())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """Wait for the handlers and the deliveries they queued to finish."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+        if self.cog.bursts is not None:
+            await self.cog.bursts.close()
+        # The delivery queue has no completion hook, poll it
+        while len(self.cog.deliveries) or self.delivering:  # noqa: ASYNC110
+            await asyncio.sleep(0.05)
+
+
+async def run(args: argparse.Namespace) -> None:
+    events = sorted(read_trace(args.trace), key=lambda entry: entry[1])[: args.limit or None]
+    if not events:
+        print("The trace is empty")
+        return
+
+    if args.routes:
+        table = RoutingTable()
+        table.restore(args.routes)
+        routes = dict(table._guilds)
+    else:
+        routes = routes_from_trace(events, args.guilds)
+
+    fake = FakeDiscord(latency=args.latency, cdn_latency=args.cdn_latency)
+    queries = QueryCounter()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await Tortoise.init(
+            db_url=f"sqlite://{Path(tmp) / 'replay.sqlite3'}",
+            modules={"models": ["wocardo.db.models"]},
+        )
+        await Tortoise.generate_schemas()
+        await seed(routes)
+        queries.install()
+
+        bot = WocardoBot()
+        await fake.install(bot, user_id=snowflake(), name="guoba")
+        add_guilds(bot, routes)
+        # setup_hook doesn't run, the routes were loaded by seed
+        bot.warm.set()
+
+        cog = Network(bot)
+        await bot.add_cog(cog)
+        if cog._startup is not None:
+            await cog._startup
+        replay = Replay(bot, cog, fake)
+        queries.count = 0
+
+        first = events[0][1]
+        start = time.perf_counter()
+        for event, at, data in events:
+            if args.speed > 0:
+                delay = (at - first) / args.speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            replay.dispatch(event, data)
+            # Let the handler start, like the gateway does between events
+            await asyncio.sleep(0)
+        await replay.drain()
+        elapsed = time.perf_counter() - start
+
+        await bot.remove_cog(cog.qualified_name)
+        await bot.http._HTTPClient__session.close()  # pyright: ignore[reportAttributeAccessIssue]
+        await fake.uninstall()
+        await Tortoise.close_connections()
+
+    report(events, replay, fake, queries, elapsed)
+
+
+def report(
+    events: list[tuple[str, float, dict[str, Any]]],
+    replay: Replay,
+    fake: FakeDiscord,
+    queries: QueryCounter,
+    elapsed: float,
+) -> None:
+    duration = events[-1][1] - events[0][1]
+    print(
+        f"events: {len(events)} over {duration:.1f}s recorded, replayed in {elapsed:.2f}s "
+        f"({len(events) / elapsed:.1f} events/s)"
+    )
+    for event, latencies in sorted(replay.handler_latencies.items()):
+        print(
+            f"  {event}: {len(latencies)} handled, p50: {percentile(latencies, 50) * 1000:.2f}ms, "
+            f"p99: {percentile(latencies, 99) * 1000:.2f}ms, max: {max(latencies) * 1000:.2f}ms"
+        )
+    fan_out = replay.fan_out_latencies
+    print(
+        f"forwarded messages: {len(fan_out)}, fan-out latency p50: {percentile(fan_out, 50):.3f}s, "
+        f"p99: {percentile(fan_out, 99):.3f}s"
+    )
+    print(f"db queries: {queries.count}, http calls: {fake.total_calls}")
+    for route, count in fake.calls.most_common():
+        print(f"  {route}: {count}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("trace", type=Path, help="trace recorded with TRACE_FILE")
+    parser.add_argument("--routes", type=Path, help="routes snapshot to seed the network from")
+    parser.add_argument(
+        "--guilds", type=int, default=20, help="receivers to generate without a snapshot"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1, help="replay speed factor, 0 for as fast as possible"
+    )
+    parser.add_argument("--limit", type=int, default=0, help="only replay the first N events")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per HTTP request")
+    parser.add_argument("--cdn-latency", type=float, default=0.05, help="seconds per download")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
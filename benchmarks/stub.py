@@ -0,0 +1,423 @@
+"""A local stand-in for the Discord HTTP API.
+
+Serves the Discord REST, webhook and CDN endpoints from a loopback aiohttp server and
+points every client session at it, so the bot runs its real HTTP stack without a
+connection to Discord, with configurable latency, rate limits and upload limits.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import math
+import re
+import socket
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, BinaryIO
+
+import aiohttp
+import discord
+from aiohttp import web
+from discord.http import Route
+from yarl import URL
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Sequence
+
+    from aiohttp.typedefs import StrOrURL
+    from discord.ext import commands
+
+    type Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+API_HOST = URL(Route.BASE).host
+API_PATH = URL(Route.BASE).path
+CDN_HOSTS = frozenset({"cdn.discordapp.com", "media.discordapp.net"})
+CDN_PATH = "/cdn"
+FILE_TOO_LARGE_RETCODE = 40005
+UNKNOWN_MESSAGE_RETCODE = 10008
+# Downloads start with a PNG signature so they can be used as avatars
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_snowflakes = itertools.count(discord.utils.time_snowflake(discord.utils.utcnow()))
+
+
+def snowflake() -> int:
+    return next(_snowflakes)
+
+
+def user_payload(user_id: int, name: str, *, bot: bool = False) -> dict[str, Any]:
+    return {
+        "id": str(user_id),
+        "username": name,
+        "discriminator": "0",
+        "global_name": None,
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+def channel_payload(channel_id: int, guild_id: int, *, nsfw: bool = False) -> dict[str, Any]:
+    return {
+        "id": str(channel_id),
+        "guild_id": str(guild_id),
+        "type": 0,
+        "name": f"channel-{channel_id}",
+        "position": 0,
+        "nsfw": nsfw,
+        "permission_overwrites": [],
+    }
+
+
+def guild_payload(guild_id: int, channels: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "id": str(guild_id),
+        "name": f"guild-{guild_id}",
+        "owner_id": "0",
+        "premium_tier": 0,
+        "features": [],
+        "roles": [],
+        "emojis": [],
+        "stickers": [],
+        "members": [],
+        "channels": channels,
+        "member_count": 0,
+    }
+
+
+def attachment_payload(attachment_id: int, filename: str, size: int) -> dict[str, Any]:
+    url = f"https://cdn.discordapp.com/attachments/0/{attachment_id}/{filename}?size={size}"
+    return {
+        "id": str(attachment_id),
+        "filename": filename,
+        "size": size,
+        "url": url,
+        "proxy_url": url,
+    }
+
+
+def message_payload(
+    message_id: int,
+    channel_id: int,
+    author: dict[str, Any],
+    *,
+    content: str = "",
+    attachments: Sequence[dict[str, Any]] = (),
+    webhook_id: int | None = None,
+) -> dict[str, Any]:
+    payload: dict[str, Any] = {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "author": author,
+        "content": content,
+        "timestamp": discord.utils.snowflake_time(message_id).isoformat(),
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": list(attachments),
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+    if webhook_id is not None:
+        payload["webhook_id"] = str(webhook_id)
+    return payload
+
+
+_IDS = re.compile(r"/\d+")
+
+
+def _size(file: BinaryIO) -> int:
+    position = file.tell()
+    file.seek(0, io.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+def _json_response(
+    data: object, *, status: int = 200, headers: dict[str, str] | None = None
+) -> web.Response:
+    # discord.py only decodes bodies whose content type is exactly application/json
+    return web.Response(
+        status=status,
+        body=json.dumps(data).encode(),
+        headers={"Content-Type": "application/json", **(headers or {})},
+    )
+
+
+async def _payload(request: web.Request) -> dict[str, Any]:
+    if request.content_type == "multipart/form-data":
+        form = await request.post()
+        return json.loads(str(form["payload_json"]))
+    if request.body_exists:
+        return await request.json()
+    return {}
+
+
+async def _no_content(_: web.Request) -> web.Response:
+    return web.Response(status=204)
+
+
+async def _query_members(*_: Any, **__: Any) -> list[discord.Member]:  # noqa: ANN401
+    return []
+
+
+@dataclass(kw_only=True)
+class FakeDiscord:
+    """Answers the requests the bot makes to Discord.
+
+    Rate limited requests get a real 429 and rejected uploads a real 413 with error
+    40005, so they go through the rate limit handling and error paths of discord.py.
+
+    Attributes:
+        latency: Seconds every REST or webhook request takes.
+        cdn_latency: Seconds every CDN download takes.
+        rate_limit_every: Answer every Nth request with a 429, 0 to disable.
+        retry_after: Seconds a 429 asks the client to wait before retrying.
+        upload_limit: Bytes over which an upload is rejected with error 40005.
+    """
+
+    latency: float = 0.05
+    cdn_latency: float = 0.05
+    rate_limit_every: int = 0
+    retry_after: float = 0.5
+    upload_limit: int = 100 * 1024 * 1024
+
+    calls: Counter[str] = field(default_factory=Counter)
+    rate_limited: int = 0
+    too_large: int = 0
+    _requests: int = 0
+    _messages: dict[int, dict[str, Any]] = field(default_factory=dict)
+    _webhooks: dict[int, dict[str, Any]] = field(default_factory=dict)
+    _channel_webhooks: dict[int, list[int]] = field(default_factory=dict)
+    _user: dict[str, Any] = field(default_factory=dict)
+    _runner: web.AppRunner | None = None
+    _base: URL | None = None
+    _patched: list[tuple[type, str, object]] = field(default_factory=list)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.rate_limited = 0
+        self.too_large = 0
+        self._requests = 0
+
+    def add_message(self, payload: dict[str, Any]) -> None:
+        """Make a message fetchable, as if it was sent to Discord."""
+        self._messages[int(payload["id"])] = payload
+
+    async def install(self, bot: commands.Bot, *, user_id: int, name: str) -> None:
+        """Start serving, route all HTTP traffic to this fake and log the bot in."""
+        self._user = user_payload(user_id, name, bot=True)
+        app = web.Application(middlewares=[self._answer], client_max_size=0)
+        self._add_routes(app.router)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        host, port = sock.getsockname()
+        self._base = URL.build(scheme="http", host=host, port=port)
+        await web.SockSite(self._runner, sock).start()
+
+        self._patch(
+            aiohttp.ClientSession, "_request", self._redirect(aiohttp.ClientSession._request)
+        )
+        # Member queries go through the gateway, Embed Fixer authors never resolve
+        self._patch(discord.Guild, "query_members", _query_members)
+
+        state = bot._connection
+        data = await bot.http.static_login("token")
+        state.user = discord.ClientUser(state=state, data=data)  # pyright: ignore[reportAttributeAccessIssue]
+        bot._ready = asyncio.Event()
+        bot._ready.set()
+        self.reset()
+
+    async def uninstall(self) -> None:
+        for target, name, original in reversed(self._patched):
+            setattr(target, name, original)
+        self._patched.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _patch(self, target: type, name: str, replacement: object) -> None:
+        self._patched.append((target, name, getattr(target, name)))
+        setattr(target, name, replacement)
+
+    def _redirect(self, request: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Wrap `ClientSession._request` to send the Discord hosts to this fake."""
+
+        async def redirected(
+            session: aiohttp.ClientSession,
+            method: str,
+            str_or_url: StrOrURL,
+            **kwargs: Any,  # noqa: ANN401
+        ) -> Any:  # noqa: ANN401
+            return await request(session, method, self._rewrite(str_or_url), **kwargs)
+
+        return redirected
+
+    def _rewrite(self, url: StrOrURL) -> StrOrURL:
+        target = URL(url)
+        if target.host == API_HOST:
+            path = target.raw_path
+        elif target.host in CDN_HOSTS:
+            path = CDN_PATH + target.raw_path
+        else:
+            return url
+        assert self._base is not None  # noqa: S101
+        return self._base.with_path(path, encoded=True).with_query(target.raw_query_string)
+
+    def _add_routes(self, router: web.UrlDispatcher) -> None:
+        api: dict[tuple[str, str], Handler] = {
+            ("GET", "/channels/{channel_id}/webhooks"): self._get_webhooks,
+            ("POST", "/channels/{channel_id}/webhooks"): self._create_webhook,
+            ("GET", "/channels/{channel_id}/messages/{message_id}"): self._get_message,
+            ("POST", "/channels/{channel_id}/messages"): self._send_message,
+            ("POST", "/webhooks/{webhook_id}/{webhook_token}"): self._execute_webhook,
+            ("GET", "/users/@me"): self._get_current_user,
+            ("GET", "/users/{user_id}"): self._get_user,
+        }
+        # Reactions, deletes and everything else answer with 204 No Content
+        for method, path in (
+            ("PUT", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me"),
+            ("DELETE", "/channels/{channel_id}/messages/{message_id}"),
+            ("DELETE", "/webhooks/{webhook_id}/{webhook_token}/messages/{message_id}"),
+        ):
+            api[method, path] = _no_content
+        for (method, path), handler in api.items():
+            router.add_route(method, API_PATH + path, handler)
+        router.add_route("*", API_PATH + "/{path:.*}", _no_content, name="api")
+        router.add_get(CDN_PATH + "/{path:.*}", self._download, name="cdn")
+
+    @web.middleware
+    async def _answer(self, request: web.Request, handler: Handler) -> web.StreamResponse:
+        resource = request.match_info.route.resource
+        if resource is not None and resource.name == "cdn":
+            self.calls["GET cdn"] += 1
+            await asyncio.sleep(self.cdn_latency)
+            return await handler(request)
+
+        if resource is None or resource.name == "api":
+            route = _IDS.sub("/{id}", request.path)
+        else:
+            route = resource.canonical
+        key = f"{request.method} {route.removeprefix(API_PATH)}"
+        self.calls[key] += 1
+        self._requests += 1
+        # Decided before sleeping, concurrent requests keep counting in the meantime
+        limited = self.rate_limit_every and self._requests % self.rate_limit_every == 0
+        await asyncio.sleep(self.latency)
+
+        if limited:
+            self.rate_limited += 1
+            return self._rate_limit(key)
+
+        if request.content_type == "multipart/form-data":
+            form = await request.post()
+            files = (value.file for value in form.values() if isinstance(value, web.FileField))
+            if sum(_size(file) for file in files) > self.upload_limit:
+                self.too_large += 1
+                return _json_response(
+                    {"code": FILE_TOO_LARGE_RETCODE, "message": "Request entity too large"},
+                    status=413,
+                )
+        return await handler(request)
+
+    def _rate_limit(self, key: str) -> web.Response:
+        return _json_response(
+            {
+                "message": "You are being rate limited.",
+                "retry_after": self.retry_after,
+                "global": False,
+            },
+            status=429,
+            headers={
+                # Without Via, discord.py takes the 429 for a Cloudflare ban and gives up
+                "Via": "1.1 google",
+                "Retry-After": str(math.ceil(self.retry_after)),
+                "X-RateLimit-Limit": "5",
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset-After": f"{self.retry_after:.3f}",
+                "X-RateLimit-Bucket": hashlib.sha256(key.encode()).hexdigest()[:32],
+                "X-RateLimit-Scope": "user",
+            },
+        )
+
+    async def _download(self, request: web.Request) -> web.Response:
+        size = int(request.query.get("size", 1024))
+        body = PNG_SIGNATURE + bytes(max(size - len(PNG_SIGNATURE), 0))
+        return web.Response(body=body, content_type="image/png")
+
+    async def _get_webhooks(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info["channel_id"])
+        webhooks = self._channel_webhooks.get(channel_id, [])
+        return _json_response([self._webhooks[webhook_id] for webhook_id in webhooks])
+
+    async def _create_webhook(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info["channel_id"])
+        payload = await _payload(request)
+        webhook_id = snowflake()
+        webhook = {
+            "id": str(webhook_id),
+            "type": 1,
+            "token": f"token-{webhook_id}",
+            "channel_id": str(channel_id),
+            "guild_id": None,
+            "name": payload.get("name", "webhook"),
+            "avatar": None,
+        }
+        self._webhooks[webhook_id] = webhook
+        self._channel_webhooks.setdefault(channel_id, []).append(webhook_id)
+        return _json_response(webhook)
+
+    async def _get_message(self, request: web.Request) -> web.Response:
+        message = self._messages.get(int(request.match_info["message_id"]))
+        if message is None:
+            return _json_response(
+                {"code": UNKNOWN_MESSAGE_RETCODE, "message": "Unknown Message"}, status=404
+            )
+        return _json_response(message)
+
+    async def _send_message(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info["channel_id"])
+        payload = await _payload(request)
+        author = user_payload(0, "bot", bot=True)
+        return _json_response(
+            message_payload(snowflake(), channel_id, author, content=payload.get("content") or "")
+        )
+
+    async def _execute_webhook(self, request: web.Request) -> web.Response:
+        webhook_id = int(request.match_info["webhook_id"])
+        payload = await _payload(request)
+        if request.query.get("wait") not in {"1", "true"}:
+            return web.Response(status=204)
+
+        webhook = self._webhooks.get(webhook_id, {})
+        channel_id = int(webhook.get("channel_id", 0))
+        author = user_payload(webhook_id, payload.get("username", "webhook"), bot=True)
+        return _json_response(
+            message_payload(
+                snowflake(),
+                channel_id,
+                author,
+                content=payload.get("content") or "",
+                webhook_id=webhook_id,
+            )
+        )
+
+    async def _get_current_user(self, _: web.Request) -> web.Response:
+        return _json_response(self._user)
+
+    async def _get_user(self, request: web.Request) -> web.Response:
+        user_id = int(request.match_info["user_id"])
+        return _json_response(user_payload(user_id, f"user-{user_id}"))
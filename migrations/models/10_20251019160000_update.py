@@ -0,0 +1,18 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "delivery" ADD "locked_until" TIMESTAMPTZ;
+        CREATE TABLE IF NOT EXISTS "deletion" (
+    "attempts" INT NOT NULL  DEFAULT 0,
+    "locked_until" TIMESTAMPTZ,
+    "id" BIGINT NOT NULL  PRIMARY KEY
+);
+COMMENT ON TABLE "deletion" IS 'A deleted message whose forwarded copies are waiting to be deleted.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "delivery" DROP COLUMN "locked_until";
+        DROP TABLE IF EXISTS "deletion";"""
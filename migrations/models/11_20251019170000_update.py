@@ -0,0 +1,26 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "senduser" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "user_id" BIGINT NOT NULL,
+    "guild_id" BIGINT NOT NULL REFERENCES "guild" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_senduser_guild_i_83f324" UNIQUE ("guild_id", "user_id")
+);
+COMMENT ON TABLE "senduser" IS 'A user whose images are forwarded when posted in the guild''s senders.';
+        INSERT INTO "senduser" ("guild_id", "user_id")
+    SELECT "guild"."id", "user_id"::BIGINT
+    FROM "guild", jsonb_array_elements_text("guild"."send_users") AS "user_id"
+    ON CONFLICT DO NOTHING;
+        ALTER TABLE "guild" DROP COLUMN "send_users";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "guild" ADD "send_users" JSONB NOT NULL DEFAULT '[]';
+        UPDATE "guild" SET "send_users" = (
+    SELECT COALESCE(jsonb_agg("user_id"), '[]') FROM "senduser" WHERE "guild_id" = "guild"."id"
+);
+        DROP TABLE IF EXISTS "senduser";"""
@@ -0,0 +1,23 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "messagelink" RENAME COLUMN "id" TO "message_id";
+        ALTER TABLE "messagelink" DROP CONSTRAINT IF EXISTS "messagelink_pkey";
+        ALTER TABLE "messagelink" ADD "id" BIGSERIAL NOT NULL PRIMARY KEY;
+        CREATE INDEX IF NOT EXISTS "idx_messagelink_message_77552d" ON "messagelink" ("message_id");
+COMMENT ON TABLE "messagelink" IS 'Links a forwarded copy to a source message, a copy of a burst has several links.';
+        ALTER TABLE "delivery" ADD "merged_ids" JSONB NOT NULL DEFAULT '[]';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "delivery" DROP COLUMN "merged_ids";
+        DELETE FROM "messagelink" AS "a" USING "messagelink" AS "b"
+    WHERE "a"."message_id" = "b"."message_id" AND "a"."id" > "b"."id";
+        ALTER TABLE "messagelink" DROP COLUMN "id";
+        DROP INDEX IF EXISTS "idx_messagelink_message_77552d";
+        ALTER TABLE "messagelink" RENAME COLUMN "message_id" TO "id";
+        ALTER TABLE "messagelink" ADD PRIMARY KEY ("id");
+COMMENT ON TABLE "messagelink" IS NULL;"""
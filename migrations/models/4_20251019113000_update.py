@@ -0,0 +1,16 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "channelwebhook" (
+    "channel_id" BIGINT NOT NULL  PRIMARY KEY,
+    "webhook_id" BIGINT NOT NULL,
+    "token" VARCHAR(100) NOT NULL
+);
+COMMENT ON TABLE "channelwebhook" IS 'The webhook the bot uses to forward messages to a receiver channel.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "channelwebhook";"""
@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "delivery" (
+    "id" BIGINT NOT NULL  PRIMARY KEY,
+    "guild_id" BIGINT NOT NULL,
+    "channel_id" BIGINT NOT NULL,
+    "author_id" BIGINT NOT NULL,
+    "nsfw" BOOL NOT NULL,
+    "attempts" INT NOT NULL  DEFAULT 0
+);
+COMMENT ON TABLE "delivery" IS 'A message waiting in the outbound delivery queue.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "delivery";"""
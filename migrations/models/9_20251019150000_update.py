@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "mediahash" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "digest" VARCHAR(64) NOT NULL,
+    "phash" BIGINT,
+    "message_id" BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "idx_mediahash_digest_20a20f" ON "mediahash" ("digest");
+CREATE INDEX IF NOT EXISTS "idx_mediahash_message_4be5c0" ON "mediahash" ("message_id");
+COMMENT ON TABLE "mediahash" IS 'Fingerprint of an image forwarded to the network, used to skip reposts.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "mediahash";"""
@@ -3,15 +3,23 @@ from __future__ import annotations
 import asyncio
 import contextlib
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import sys
+from typing import TYPE_CHECKING
 
 import discord
 from loguru import logger
 
 from wocardo.bot import WocardoBot
+from wocardo.cluster import split_shards
+from wocardo.config import CLUSTER_COUNT, ROLE, SHARD_COUNT
 from wocardo.logging import InterceptHandler
 
+if TYPE_CHECKING:
+    from collections.abc import Coroutine
+
 env = os.getenv("ENV", "dev")
 if env == "dev":
     logger.info("Running in development mode")
@@ -19,28 +27,106 @@ else:
     logger.info("Running in production mode")
 
 
-async def main() -> None:
+def get_token() -> str:
     token = os.getenv("DISCORD_TOKEN")
     if token is None:
         msg = "Env variable 'DISCORD_TOKEN' is not set"
         raise ValueError(msg)
+    return token
+
 
-    async with WocardoBot() as bot:
+async def main(
+    *,
+    cluster_id: int | None = None,
+    shard_ids: list[int] | None = None,
+    shard_count: int | None = None,
+) -> None:
+    token = get_token()
+    async with WocardoBot(
+        cluster_id=cluster_id, shard_ids=shard_ids, shard_count=shard_count
+    ) as bot:
         with contextlib.suppress(KeyboardInterrupt, asyncio.CancelledError):
-            await bot.start(token)
+            if ROLE == "worker":
+                # Workers only use the REST API to process the jobs queued by the gateway
+                await bot.login(token)
+                await asyncio.Event().wait()
+            else:
+                await bot.start(token)
 
 
-if __name__ == "__main__":
+async def fetch_shard_count() -> int:
+    async with discord.Client(intents=discord.Intents.none()) as client:
+        await client.login(get_token())
+        shard_count, *_ = await client.http.get_bot_gateway()
+    return shard_count
+
+
+def setup_logging(cluster_id: int | None = None) -> None:
     discord.VoiceClient.warn_nacl = False
 
     logger.remove()
     logger.add(sys.stderr, level="DEBUG" if env == "dev" else "INFO")
     logging.basicConfig(handlers=[InterceptHandler()], level=logging.INFO, force=True)
-    logger.add("logs/wocardo_network.log", rotation="1 day", retention="2 weeks", level="DEBUG")
+    log_name = "wocardo_network"
+    if cluster_id is not None:
+        log_name += f"_{cluster_id}"
+    if ROLE != "all":
+        # pm2 numbers the instances of an app
+        log_name += f"_{ROLE}_{os.getenv('NODE_APP_INSTANCE', '0')}"
+    logger.add(f"logs/{log_name}.log", rotation="1 day", retention="2 weeks", level="DEBUG")
 
+
+def run(coro: Coroutine[None, None, None]) -> None:
     try:
-        import uvloop  # pyright: ignore[reportMissingImports]
+        import uvloop  # noqa: PLC0415  # pyright: ignore[reportMissingImports]
     except ImportError:
-        asyncio.run(main())
+        asyncio.run(coro)
+    else:
+        uvloop.run(coro)
+
+
+def run_cluster(cluster_id: int, shard_ids: list[int], shard_count: int) -> None:
+    setup_logging(cluster_id)
+    run(main(cluster_id=cluster_id, shard_ids=shard_ids, shard_count=shard_count))
+
+
+def run_clusters() -> None:
+    """Run the shards across `CLUSTER_COUNT` processes.
+
+    If any of them exits, the others are stopped too so the process manager restarts
+    the whole cluster.
+    """
+    shard_count = SHARD_COUNT or asyncio.run(fetch_shard_count())
+    clusters = split_shards(shard_count, min(CLUSTER_COUNT, shard_count))
+    logger.info(f"Starting {len(clusters)} clusters with {shard_count} shards")
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_cluster,
+            args=(cluster_id, shard_ids, shard_count),
+            name=f"cluster-{cluster_id}",
+        )
+        for cluster_id, shard_ids in enumerate(clusters)
+    ]
+    for process in processes:
+        process.start()
+
+    with contextlib.suppress(KeyboardInterrupt):
+        multiprocessing.connection.wait([process.sentinel for process in processes])
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        if process.exitcode:
+            logger.error(f"{process.name} exited with code {process.exitcode}")
+    sys.exit(1 if any(process.exitcode for process in processes) else 0)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    if CLUSTER_COUNT > 1 and ROLE != "worker":
+        run_clusters()
     else:
-        uvloop.run(main())
+        run(main())
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Self
+
+import aiohttp
+import discord
+
+from wocardo.metrics import METRICS
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from wocardo.media import MediaRecompressor
+
+CHUNK_SIZE = 256 * 1024
+
+
+class Spooler:
+    """Relays large attachments through temporary files, so a transfer only ever holds a
+    chunk of them in memory.
+
+    Attachments over `threshold` bytes are streamed to disk, and so are the ones that
+    would take the attachments held in memory by the whole process over `memory_limit`.
+    """
+
+    def __init__(self, *, threshold: int, memory_limit: int) -> None:
+        self.threshold = threshold
+        self.memory_limit = memory_limit
+        self.in_memory = 0
+        """Bytes of attachments currently held in memory."""
+        self._session: aiohttp.ClientSession | None = None
+        self._directory: tempfile.TemporaryDirectory[str] | None = None
+
+    def reserve(self, size: int) -> bool:
+        """Account for an attachment about to be read into memory, if it should be."""
+        if size > self.threshold or self.in_memory + size > self.memory_limit:
+            return False
+        self.in_memory += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.in_memory -= size
+
+    async def spool(self, attachment: discord.Attachment) -> Path:
+        """Download an attachment to a temporary file, a chunk at a time."""
+        if self._directory is None:
+            self._directory = tempfile.TemporaryDirectory(prefix="wocardo-")
+        fd, name = tempfile.mkstemp(dir=self._directory.name, suffix=f"-{attachment.id}")
+        path = Path(name)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                await self._fetch(attachment, file)
+        except BaseException:
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+            raise
+        return path
+
+    async def _fetch(self, attachment: discord.Attachment, file: BinaryIO) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        async with self._session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                await asyncio.to_thread(file.write, chunk)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._directory is not None:
+            self._directory.cleanup()
+            self._directory = None
+
+
+class AttachmentBundle:
+    """Attachments of the source messages, downloaded once and shared by every destination.
+
+    An attachment is downloaded the first time a destination uploads it. Each destination
+    gets its own `discord.File`, but all of them read from the same downloaded bytes,
+    which are released when the bundle is closed. Large attachments are downloaded to a
+    temporary file by the spooler instead, which every destination uploads from. Images
+    recompressed for a limit are likewise shared by the destinations with that limit.
+    """
+
+    def __init__(
+        self,
+        attachments: list[discord.Attachment],
+        *,
+        recompressor: MediaRecompressor | None = None,
+        spooler: Spooler | None = None,
+    ) -> None:
+        self.attachments = attachments
+        self.recompressor = recompressor
+        self.spooler = spooler
+        self._downloads: dict[int, asyncio.Task[bytes | Path]] = {}
+        # Recompressed images by (attachment ID, size limit)
+        self._shrunk: dict[tuple[int, int], asyncio.Task[bytes | None]] = {}
+        self._reserved = 0
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
+
+    def plan(
+        self, filesize_limit: int, attachments: list[discord.Attachment] | None = None
+    ) -> tuple[list[discord.Attachment], list[discord.Attachment]]:
+        """Split the attachments, all of the bundle's by default, into ones that can be
+        uploaded under the limit and ones that have to be sent as links.
+        """
+        uploads: list[discord.Attachment] = []
+        links: list[discord.Attachment] = []
+        for attachment in self.attachments if attachments is None else attachments:
+            (uploads if attachment.size <= filesize_limit else links).append(attachment)
+        return uploads, links
+
+    async def _get(self, attachment: discord.Attachment) -> bytes | Path:
+        download = self._downloads.get(attachment.id)
+        if download is None:
+            download = self._downloads[attachment.id] = asyncio.create_task(
+                self._download(attachment)
+            )
+        return await asyncio.shield(download)
+
+    async def read(self, attachment: discord.Attachment) -> bytes | Path:
+        """Return the attachment's content, or the path of its file if it was spooled.
+
+        Spooled attachments are never read into memory as a whole, they're only read from
+        the file by whatever processes them, outside the event loop.
+        """
+        return await self._get(attachment)
+
+    async def _download(self, attachment: discord.Attachment) -> bytes | Path:
+        with METRICS.time("download"):
+            if self.spooler is None:
+                return await attachment.read()
+            if not self.spooler.reserve(attachment.size):
+                METRICS.inc("spooled")
+                return await self.spooler.spool(attachment)
+
+            self._reserved += attachment.size
+            return await attachment.read()
+
+    async def files(
+        self,
+        attachments: list[discord.Attachment],
+        shrunk: list[tuple[discord.Attachment, bytes]] | None = None,
+    ) -> list[discord.File]:
+        """Build new files to upload the attachments and the recompressed images with.
+
+        discord.py closes the files it sent, so every upload needs its own.
+        """
+        data = await asyncio.gather(*(self._get(a) for a in attachments))
+        # BytesIO shares the buffer of an immutable bytes object until it is written to,
+        # spooled attachments are read from their file a chunk at a time while uploading
+        files = [
+            discord.File(
+                content if isinstance(content, Path) else io.BytesIO(content),
+                filename=attachment.filename,
+                spoiler=attachment.is_spoiler(),
+                description=attachment.description,
+            )
+            for attachment, content in zip(attachments, data, strict=True)
+        ]
+        if shrunk and self.recompressor is not None:
+            files.extend(
+                discord.File(
+                    io.BytesIO(content),
+                    filename=self.recompressor.filename(attachment),
+                    spoiler=attachment.is_spoiler(),
+                    description=attachment.description,
+                )
+                for attachment, content in shrunk
+            )
+        return files
+
+    async def shrink(
+        self, attachments: list[discord.Attachment], filesize_limit: int
+    ) -> tuple[list[tuple[discord.Attachment, bytes]], list[discord.Attachment]]:
+        """Recompress the images that are over the limit.
+
+        Returns:
+            The recompressed images with their attachment, to pass to `files`, and the
+            attachments that still have to be sent as links.
+        """
+        recompressor = self.recompressor
+        if recompressor is None:
+            return [], attachments
+
+        async def recompress(attachment: discord.Attachment) -> bytes | None:
+            data = await self.read(attachment)
+            return await recompressor.recompress(attachment, data, filesize_limit)
+
+        def shared(attachment: discord.Attachment) -> asyncio.Task[bytes | None]:
+            key = (attachment.id, filesize_limit)
+            task = self._shrunk.get(key)
+            if task is None:
+                task = self._shrunk[key] = asyncio.create_task(recompress(attachment))
+            return task
+
+        candidates = [a for a in attachments if recompressor.supports(a)]
+        results = await asyncio.gather(*(asyncio.shield(shared(a)) for a in candidates))
+
+        shrunk = [
+            (attachment, data)
+            for attachment, data in zip(candidates, results, strict=True)
+            if data is not None
+        ]
+        shrunk_ids = {attachment.id for attachment, _ in shrunk}
+        return shrunk, [a for a in attachments if a.id not in shrunk_ids]
+
+    def release(self) -> None:
+        for task in self._shrunk.values():
+            task.cancel()
+        self._shrunk.clear()
+
+        for download in self._downloads.values():
+            if not download.done():
+                download.cancel()
+            elif not download.cancelled() and download.exception() is None:
+                content = download.result()
+                if isinstance(content, Path):
+                    content.unlink(missing_ok=True)
+        self._downloads.clear()
+
+        if self.spooler is not None:
+            self.spooler.release(self._reserved)
+            self._reserved = 0
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from collections.abc import Coroutine
+
+
+class BackgroundTasks:
+    """Fire-and-forget tasks, referenced until they finish so they aren't garbage collected.
+
+    A task that fails is logged with `error` instead of its exception being left unretrieved.
+    """
+
+    def __init__(self, error: str) -> None:
+        self.error = error
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def spawn(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task[None]) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            logger.opt(exception=exc).error(self.error)
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
+    async def wait(self) -> None:
+        """Wait for the running tasks to finish."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,18 +1,47 @@
 from __future__ import annotations
 
+import asyncio
+import os
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import discord
 from discord.ext import commands
 from loguru import logger
-from tortoise import Tortoise
+from tortoise import Tortoise, connections
 
+from wocardo.background import BackgroundTasks
+from wocardo.cluster import RouteSync, create_route_sync, shard_of
 from wocardo.command_tree import CommandTree
-from wocardo.db.config import TORTOISE_ORM
+from wocardo.config import (
+    CLUSTER_COUNT,
+    CLUSTER_SYNC_PORT,
+    METRICS_HOST,
+    METRICS_PORT,
+    ROLE,
+    ROUTES_SNAPSHOT,
+    TRACE_FILE,
+    WORKER_COUNT,
+)
+from wocardo.db.config import DATABASE_URI, TORTOISE_ORM
+from wocardo.db.models import Guild
+from wocardo.db.routing import ROUTES
+from wocardo.metrics import METRICS
+from wocardo.trace import TraceRecorder
 
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
 
-class WocardoBot(commands.Bot):
-    def __init__(self) -> None:
+
+class WocardoBot(commands.AutoShardedBot):
+    def __init__(
+        self,
+        *,
+        cluster_id: int | None = None,
+        shard_ids: list[int] | None = None,
+        shard_count: int | None = None,
+    ) -> None:
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(
@@ -28,13 +57,125 @@ class WocardoBot(commands.Bot):
             ),
             allowed_mentions=discord.AllowedMentions.none(),
             tree_cls=CommandTree,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            # Needed for on_socket_raw_receive
+            enable_debug_events=bool(TRACE_FILE),
         )
         self.user: discord.ClientUser
+        self.metrics = METRICS
+        self.cluster_id = cluster_id
+        """ID of this process in cluster mode, `None` when running a single process."""
+        self.route_sync: RouteSync | None = None
+        self.recorder: TraceRecorder | None = None
+
+        self.warm = asyncio.Event()
+        """Set once the warm-up phases are done."""
+        self._warm_up_phases: dict[str, Callable[[], Awaitable[object]]] = {}
+        self._background = BackgroundTasks("Failed to warm up")
+
+    @property
+    def process_id(self) -> int:
+        """Index of this process among the processes of the bot, to give each its own port.
+
+        Clusters come first, followed by the worker instances numbered by pm2.
+        """
+        if ROLE == "worker":
+            return CLUSTER_COUNT + int(os.getenv("NODE_APP_INSTANCE", "0"))
+        return self.cluster_id or 0
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether the guild is on one of the shards of this process."""
+        if self.shard_ids is None or self.shard_count is None:
+            return True
+        return shard_of(guild_id, self.shard_count) in self.shard_ids
+
+    def add_warm_up_phase(self, name: str, phase: Callable[[], Awaitable[object]]) -> None:
+        """Run a phase while the gateway connects, after the database connection is open.
+
+        Phases added once the bot is warm, e.g. by a reloaded cog, run right away.
+        """
+        if self.warm.is_set():
+            self._background.spawn(self._run_phase(name, phase))
+        else:
+            self._warm_up_phases[name] = phase
+
+    @staticmethod
+    async def _run_phase(name: str, phase: Callable[[], Awaitable[object]]) -> None:
+        start = time.perf_counter()
+        try:
+            await phase()
+        except Exception:
+            logger.exception(f"Warm-up phase {name!r} failed")
+        else:
+            logger.info(f"Warm-up phase {name!r} took {time.perf_counter() - start:.2f}s")
+
+    async def _open_database(self) -> None:
+        await connections.get("default").execute_query("SELECT 1")
+
+    async def _load_routes(self) -> None:
+        await Guild.load_routes()
+        await asyncio.to_thread(ROUTES.save, Path(ROUTES_SNAPSHOT))
+        logger.info(f"Loaded routes of {len(ROUTES)} guilds")
+
+    async def _warm_up(self) -> None:
+        start = time.perf_counter()
+        await self._run_phase("database", self._open_database)
+        await asyncio.gather(
+            *(self._run_phase(name, phase) for name, phase in self._warm_up_phases.items())
+        )
+        self._warm_up_phases.clear()
+        self.warm.set()
+        logger.info(f"Warmed up in {time.perf_counter() - start:.2f}s")
+
+    async def _serve_metrics(self) -> None:
+        METRICS.enable()
+        METRICS.instrument(connections.get("default"))
+        # Every process of a cluster or a gateway/worker split gets its own port
+        port = METRICS_PORT + self.process_id
+        try:
+            await METRICS.serve(METRICS_HOST, port)
+        except OSError:
+            logger.exception(f"Failed to serve metrics on {METRICS_HOST}:{port}")
+        else:
+            logger.info(f"Serving metrics on {METRICS_HOST}:{port}")
 
     async def setup_hook(self) -> None:
+        start = time.perf_counter()
         logger.info("Initializing database")
         await Tortoise.init(TORTOISE_ORM)
 
+        if METRICS_PORT:
+            await self._serve_metrics()
+
+        if TRACE_FILE:
+            path = Path(TRACE_FILE)
+            if self.cluster_id is not None:
+                stem, dot, suffixes = path.name.partition(".")
+                path = path.with_name(f"{stem}_{self.cluster_id}{dot}{suffixes}")
+            self.recorder = TraceRecorder(path)
+            self.recorder.open()
+            self.add_listener(self.recorder.record, "on_socket_raw_receive")
+            logger.info(f"Recording gateway events to {path}")
+
+        # The last known routes let messages be routed before the database is read
+        if await asyncio.to_thread(ROUTES.restore, Path(ROUTES_SNAPSHOT)):
+            logger.info(f"Restored routes of {len(ROUTES)} guilds from the snapshot")
+        self.add_warm_up_phase("routes", self._load_routes)
+
+        # Every process keeps its own copy of the routes
+        if self.cluster_id is not None or ROLE != "all":
+            self.route_sync = create_route_sync(
+                DATABASE_URI,
+                process_id=self.process_id,
+                processes=CLUSTER_COUNT + (WORKER_COUNT if ROLE != "all" else 0),
+                port=CLUSTER_SYNC_PORT,
+            )
+            await self.route_sync.start(Guild.reload_route)
+            ROUTES.subscribe(self.route_sync.publish)
+        if self.cluster_id is not None:
+            logger.info(f"Running cluster {self.cluster_id} with shards {self.shard_ids}")
+
         for filepath in Path("wocardo/cogs").glob("**/*.py"):
             cog_name = Path(filepath).stem
             try:
@@ -45,6 +186,19 @@ class WocardoBot(commands.Bot):
 
         await self.load_extension("jishaku")
 
+        # Warm up while the gateway connects instead of delaying the login
+        self._background.spawn(self._warm_up())
+        logger.info(f"Setup took {time.perf_counter() - start:.2f}s")
+
     async def close(self) -> None:
         await super().close()
+        self._background.cancel()
+        if ROUTES.loaded:
+            await asyncio.to_thread(ROUTES.save, Path(ROUTES_SNAPSHOT))
+        if self.route_sync is not None:
+            await self.route_sync.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            logger.info(f"Recorded {self.recorder.recorded} gateway events")
+        await METRICS.close()
         await Tortoise.close_connections()
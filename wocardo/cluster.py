@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+from wocardo.background import BackgroundTasks
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    import asyncpg
+
+ROUTES_CHANNEL = "wocardo_routes"
+POSTGRES_SCHEMES = {"postgres", "asyncpg", "psycopg"}
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    return (guild_id >> 22) % shard_count
+
+
+def split_shards(shard_count: int, clusters: int) -> list[list[int]]:
+    """Spread the shard IDs evenly across the clusters."""
+    return [list(range(i, shard_count, clusters)) for i in range(clusters)]
+
+
+class RouteSync(abc.ABC):
+    """Propagates routing table changes to the other processes of a cluster.
+
+    The ID of every guild whose routes changed is published, and the receiving processes
+    reload that guild's routes from the database.
+    """
+
+    def __init__(self) -> None:
+        self._on_change: Callable[[int], Awaitable[None]] | None = None
+        self._tasks = BackgroundTasks("Failed to sync routing change")
+
+    async def start(self, on_change: Callable[[int], Awaitable[None]]) -> None:
+        self._on_change = on_change
+        await self._connect()
+
+    async def close(self) -> None:
+        self._tasks.cancel()
+
+    def publish(self, guild_id: int) -> None:
+        self._tasks.spawn(self._send(guild_id))
+
+    def _received(self, guild_id: int) -> None:
+        logger.debug(f"Routes of guild {guild_id} were changed by another process")
+        if self._on_change is not None:
+            self._tasks.spawn(self._on_change(guild_id))
+
+    @abc.abstractmethod
+    async def _connect(self) -> None: ...
+
+    @abc.abstractmethod
+    async def _send(self, guild_id: int) -> None: ...
+
+
+class PostgresRouteSync(RouteSync):
+    """Syncs routes with Postgres LISTEN/NOTIFY on a dedicated connection."""
+
+    def __init__(self, dsn: str) -> None:
+        super().__init__()
+        self.dsn = dsn
+        self._connection: asyncpg.Connection | None = None
+
+    async def _connect(self) -> None:
+        import asyncpg  # noqa: PLC0415
+
+        self._connection = await asyncpg.connect(self.dsn)
+        await self._connection.add_listener(ROUTES_CHANNEL, self._notified)
+
+    def _notified(self, connection: asyncpg.Connection, pid: int, _: str, payload: str) -> None:
+        # Notifications are also delivered to the connection that sent them
+        if pid != connection.get_server_pid():
+            self._received(int(payload))
+
+    async def _send(self, guild_id: int) -> None:
+        if self._connection is not None:
+            await self._connection.execute(
+                "SELECT pg_notify($1, $2)", ROUTES_CHANNEL, str(guild_id)
+            )
+
+    async def close(self) -> None:
+        await super().close()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback: Callable[[int], None]) -> None:
+        self.callback = callback
+
+    def datagram_received(self, data: bytes, addr: tuple[str | Any, int]) -> None:  # noqa: ARG002
+        self.callback(int(data))
+
+
+class SocketRouteSync(RouteSync):
+    """Syncs routes with UDP datagrams on localhost, for databases without LISTEN/NOTIFY.
+
+    Every process listens on `port + process_id`.
+    """
+
+    def __init__(self, *, process_id: int, processes: int, port: int) -> None:
+        super().__init__()
+        self.process_id = process_id
+        self.processes = processes
+        self.port = port
+        self._transport: asyncio.DatagramTransport | None = None
+
+    async def _connect(self) -> None:
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _DatagramProtocol(self._received),
+            local_addr=("127.0.0.1", self.port + self.process_id),
+        )
+
+    async def _send(self, guild_id: int) -> None:
+        if self._transport is None:
+            return
+        for process_id in range(self.processes):
+            if process_id != self.process_id:
+                self._transport.sendto(
+                    str(guild_id).encode(), ("127.0.0.1", self.port + process_id)
+                )
+
+    async def close(self) -> None:
+        await super().close()
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+
+def create_route_sync(
+    database_uri: str, *, process_id: int, processes: int, port: int
+) -> RouteSync:
+    scheme, _, rest = database_uri.partition("://")
+    if scheme in POSTGRES_SCHEMES:
+        # asyncpg doesn't understand Tortoise's query parameters
+        return PostgresRouteSync(f"postgresql://{rest.split('?', 1)[0]}")
+    return SocketRouteSync(process_id=process_id, processes=processes, port=port)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from wocardo.background import BackgroundTasks
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    import discord
+
+MAX_FILES = 10
+# Leaves room for the guild name that is prepended when a receiver has no webhook
+MAX_CONTENT = 1900
+
+
+def _content_size(message: discord.Message) -> int:
+    """Return how much of a post a message can take, with every attachment as a link."""
+    return len(message.content) + sum(len(a.url) + 1 for a in message.attachments) + 1
+
+
+@dataclass(slots=True)
+class _Burst:
+    handle: asyncio.TimerHandle
+    messages: list[tuple[discord.Message, discord.Member | None]] = field(default_factory=list)
+    files: int = 0
+    content: int = 0
+
+
+class BurstCoalescer:
+    """Groups the consecutive uploads of an author in a sender channel into one post.
+
+    A burst is flushed `window` seconds after its first message, or as soon as another
+    message wouldn't fit in a single post. Messages are only held in memory, the flushed
+    burst is what gets queued for delivery.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[list[tuple[discord.Message, discord.Member | None]]], Awaitable[None]],
+        *,
+        window: float,
+    ) -> None:
+        self.flush = flush
+        self.window = window
+        self._bursts: dict[tuple[int, int], _Burst] = {}
+        self._tasks = BackgroundTasks("Failed to queue a burst of messages")
+
+    def __len__(self) -> int:
+        return len(self._bursts)
+
+    def add(self, message: discord.Message, author: discord.Member | None) -> None:
+        key = (message.channel.id, (author or message.author).id)
+        files = len(message.attachments)
+        content = _content_size(message)
+
+        burst = self._bursts.get(key)
+        if burst is not None and (
+            burst.files + files > MAX_FILES or burst.content + content > MAX_CONTENT
+        ):
+            self._flush(key)
+            burst = None
+        if burst is None:
+            handle = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+            burst = self._bursts[key] = _Burst(handle)
+
+        burst.messages.append((message, author))
+        burst.files += files
+        burst.content += content
+        if burst.files >= MAX_FILES:
+            self._flush(key)
+
+    def discard(self, channel_id: int, message_id: int) -> bool:
+        """Drop a deleted message from its burst, returns whether it was in one."""
+        for key, burst in self._bursts.items():
+            if key[0] != channel_id:
+                continue
+            for i, (message, _) in enumerate(burst.messages):
+                if message.id == message_id:
+                    del burst.messages[i]
+                    burst.files -= len(message.attachments)
+                    burst.content -= _content_size(message)
+                    if not burst.messages:
+                        burst.handle.cancel()
+                        del self._bursts[key]
+                    return True
+        return False
+
+    def _flush(self, key: tuple[int, int]) -> None:
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return
+        burst.handle.cancel()
+        self._tasks.spawn(self.flush(burst.messages))
+
+    async def close(self) -> None:
+        """Flush the pending bursts right away and wait for them to be queued."""
+        for key in list(self._bursts):
+            self._flush(key)
+        await self._tasks.wait()
@@ -1,25 +1,259 @@
 from __future__ import annotations
 
+import asyncio
 import re
+import time
+from datetime import timedelta
 from typing import TYPE_CHECKING
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from loguru import logger
 
-from wocardo.db.models import Guild, MessageLink
+from wocardo.attachments import AttachmentBundle, Spooler
+from wocardo.cache import TTLCache
+from wocardo.coalesce import BurstCoalescer
+from wocardo.config import (
+    AUTHOR_CACHE_SIZE,
+    AUTHOR_CACHE_TTL,
+    AUTHOR_NEGATIVE_CACHE_TTL,
+    COALESCE_WINDOW,
+    DEDUP_CACHE_SIZE,
+    DEDUP_MODE,
+    DEDUP_THRESHOLD,
+    DEDUP_WINDOW,
+    DELETE_CONCURRENCY,
+    DELIVERY_MAX_ATTEMPTS,
+    DELIVERY_RETRY_DELAY,
+    DELIVERY_WORKERS,
+    FORWARD_CONCURRENCY,
+    LINK_PRUNE_BATCH,
+    LINK_RETENTION_DAYS,
+    MEDIA_MEMORY_LIMIT,
+    MEDIA_RECOMPRESS,
+    MEDIA_RECOMPRESS_WORKERS,
+    MEDIA_STREAM_THRESHOLD,
+    ROLE,
+    WORKER_LEASE,
+    WORKER_POLL_INTERVAL,
+)
+from wocardo.db.models import Channel, Deletion, Delivery, Guild, MessageLink
+from wocardo.db.routing import ROUTES
+from wocardo.dedup import DedupIndex
+from wocardo.delivery import DeliveryQueue
+from wocardo.media import MediaRecompressor, is_image
+from wocardo.metrics import METRICS
+from wocardo.ratelimit import RateLimitScheduler, Route
+from wocardo.webhooks import WebhookCache
 
 if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
     from wocardo.bot import WocardoBot
 
 FILE_TOO_LARGE_RETCODE = 40005
+UNKNOWN_WEBHOOK_RETCODE = 10015
 MEDIA_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".mp4", ".mov", ".mkv"}
+MEDIA_PATTERN = re.compile("|".join(re.escape(ext) for ext in sorted(MEDIA_EXTS)))
 NAME_PATTERN = r"^(.*?)\s+\(來自:.*\)$"
+ROUTE_CHECK_INTERVAL = 10  # minutes
+REMOTE_RECEIVER_TTL = 600  # seconds
+LINK_PRUNE_INTERVAL = 60  # minutes
+FINGERPRINT_PRUNE_INTERVAL = 60  # minutes
+BURST_DELIVERY_TTL = 3600  # seconds
+
+type ReceiverChannel = discord.abc.GuildChannel | discord.Thread
+# Builds the files of a post, again for every attempt since sent files are closed
+type FileFactory = Callable[[], Awaitable[list[discord.File]]]
 
 
 class Network(commands.Cog):
     def __init__(self, bot: WocardoBot) -> None:
         self.bot = bot
+        self._forward_semaphore = asyncio.Semaphore(FORWARD_CONCURRENCY)
+        self._delete_semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+        self.ratelimits = RateLimitScheduler()
+        self.dedup: DedupIndex | None = None
+        if DEDUP_MODE in {"skip", "link"}:
+            self.dedup = DedupIndex(
+                window=DEDUP_WINDOW * 3600, threshold=DEDUP_THRESHOLD, maxsize=DEDUP_CACHE_SIZE
+            )
+        self.recompressor: MediaRecompressor | None = None
+        if MEDIA_RECOMPRESS:
+            if MediaRecompressor.is_available():
+                self.recompressor = MediaRecompressor(workers=MEDIA_RECOMPRESS_WORKERS)
+            else:
+                logger.warning("MEDIA_RECOMPRESS is enabled but Pillow is not installed")
+        self.spooler = Spooler(threshold=MEDIA_STREAM_THRESHOLD, memory_limit=MEDIA_MEMORY_LIMIT)
+        self.webhooks = WebhookCache(bot)
+        # Member events need the privileged members intent, renamed or departed members
+        # are picked up once their entry expires instead
+        self._authors: TTLCache[tuple[int, str], discord.Member | None] = TTLCache(
+            maxsize=AUTHOR_CACHE_SIZE, ttl=AUTHOR_CACHE_TTL
+        )
+        self._pending: dict[int, tuple[discord.Message, discord.Member | None]] = {}
+        self.bursts: BurstCoalescer | None = None
+        if COALESCE_WINDOW > 0:
+            self.bursts = BurstCoalescer(self._queue_delivery, window=COALESCE_WINDOW)
+        # ID of the delivery each merged message of a queued burst is part of
+        self._burst_of: TTLCache[int, int] = TTLCache(maxsize=4096, ttl=BURST_DELIVERY_TTL)
+        # Guilds and receivers that aren't in the cache of this process, fetched over REST
+        self._remote_guilds: TTLCache[int, discord.Guild] = TTLCache(
+            maxsize=1024, ttl=REMOTE_RECEIVER_TTL
+        )
+        self._remote_receivers: TTLCache[int, tuple[discord.Guild, ReceiverChannel]] = TTLCache(
+            maxsize=1024, ttl=REMOTE_RECEIVER_TTL
+        )
+        # Gateway and worker processes share the queues through the database
+        self.deliveries = DeliveryQueue(
+            Delivery,
+            self._deliver,
+            workers=DELIVERY_WORKERS,
+            max_attempts=DELIVERY_MAX_ATTEMPTS,
+            retry_delay=DELIVERY_RETRY_DELAY,
+            shared=ROLE != "all",
+            poll_interval=WORKER_POLL_INTERVAL,
+            lease=WORKER_LEASE,
+        )
+        self.deletions = DeliveryQueue(
+            Deletion,
+            self._process_deletion,
+            workers=DELIVERY_WORKERS,
+            max_attempts=DELIVERY_MAX_ATTEMPTS,
+            retry_delay=DELIVERY_RETRY_DELAY,
+            shared=True,
+            poll_interval=WORKER_POLL_INTERVAL,
+            lease=WORKER_LEASE,
+        )
+        self._startup: asyncio.Task[None] | None = None
+
+    async def cog_load(self) -> None:
+        METRICS.gauge("delivery_queue_depth", lambda: len(self.deliveries))
+        METRICS.gauge("ratelimit_waiting", self._ratelimit_waiting, label="route")
+        METRICS.gauge("attachment_memory_bytes", lambda: self.spooler.in_memory)
+        self.check_routes.start()
+        # One process is enough to prune the shared tables
+        if ROLE != "worker" and not self.bot.cluster_id:
+            if LINK_RETENTION_DAYS > 0:
+                self.prune_links.start()
+            if self.dedup is not None:
+                self.prune_fingerprints.start()
+        if ROLE == "gateway":
+            logger.info("Running as a gateway, jobs are processed by worker processes")
+            return
+
+        self.bot.add_warm_up_phase("webhooks", self._load_webhooks)
+        if self.dedup is not None:
+            self.bot.add_warm_up_phase("fingerprints", self._load_fingerprints)
+        self._startup = asyncio.create_task(self._start_delivering())
+
+    async def cog_unload(self) -> None:
+        if self._startup is not None:
+            self._startup.cancel()
+        self.check_routes.cancel()
+        self.prune_links.cancel()
+        self.prune_fingerprints.cancel()
+        if self.bursts is not None:
+            # Queued bursts are resumed on the next start
+            await self.bursts.close()
+        await self.deliveries.stop()
+        await self.deletions.stop()
+        await self.spooler.close()
+        if self.recompressor is not None:
+            self.recompressor.close()
+
+    def _ratelimit_waiting(self) -> dict[str, float]:
+        waiting: dict[str, float] = {}
+        for bucket, depth in self.ratelimits.depths().items():
+            route = bucket.split(":", 1)[0]
+            waiting[route] = waiting.get(route, 0) + depth
+        return waiting
+
+    async def _load_webhooks(self) -> None:
+        await self.webhooks.load()
+        logger.info(f"Loaded {len(self.webhooks)} cached webhooks")
+
+    async def _load_fingerprints(self) -> None:
+        if self.dedup is not None:
+            logger.info(f"Loaded {await self.dedup.load()} image fingerprints")
+
+    async def _start_delivering(self) -> None:
+        """Start the queues once the bot is warm, then resolve the receiver channels so
+        the first deliveries don't have to.
+        """
+        await self.bot.warm.wait()
+        resumed = await self.deliveries.start(lambda d: self.bot.owns_guild(d.guild_id))
+        logger.info(f"Started delivery queue, resumed {resumed} pending deliveries")
+        if ROLE == "worker":
+            await self.deletions.start()
+            logger.info("Running as a worker, polling the job queues")
+        else:
+            await self.bot.wait_until_ready()
+
+        start = time.perf_counter()
+        receivers = {
+            *ROUTES.receivers(nsfw=False, exclude_guild=0),
+            *ROUTES.receivers(nsfw=True, exclude_guild=0),
+        }
+        semaphore = asyncio.Semaphore(FORWARD_CONCURRENCY)
+
+        async def resolve(receiver: tuple[int, int]) -> bool:
+            async with semaphore:
+                try:
+                    await self._resolve_receiver(receiver)
+                except discord.HTTPException:
+                    return False
+                return True
+
+        resolved = sum(await asyncio.gather(*(resolve(r) for r in receivers)))
+        logger.info(
+            f"Resolved {resolved}/{len(receivers)} receiver channels "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+    @tasks.loop(minutes=ROUTE_CHECK_INTERVAL)
+    async def check_routes(self) -> None:
+        stale = await Guild.check_routes()
+        if stale:
+            logger.warning(f"Reloaded routing table, {len(stale)} guilds were out of sync: {stale}")
+
+    @check_routes.before_loop
+    async def before_check_routes(self) -> None:
+        # The routes were just loaded by the warm-up
+        await self.bot.warm.wait()
+        await asyncio.sleep(ROUTE_CHECK_INTERVAL * 60)
+
+    @tasks.loop(minutes=LINK_PRUNE_INTERVAL)
+    async def prune_links(self) -> None:
+        before = discord.utils.time_snowflake(
+            discord.utils.utcnow() - timedelta(days=LINK_RETENTION_DAYS)
+        )
+        start = time.perf_counter()
+        pruned = await MessageLink.prune(before, batch_size=LINK_PRUNE_BATCH)
+        METRICS.inc("links_pruned", pruned)
+        logger.info(
+            f"Pruned {pruned} message links older than {LINK_RETENTION_DAYS:g} days "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+    @prune_links.before_loop
+    async def before_prune_links(self) -> None:
+        await self.bot.warm.wait()
+
+    @tasks.loop(minutes=FINGERPRINT_PRUNE_INTERVAL)
+    async def prune_fingerprints(self) -> None:
+        if self.dedup is None:
+            return
+        start = time.perf_counter()
+        pruned = await self.dedup.prune(batch_size=LINK_PRUNE_BATCH)
+        logger.info(
+            f"Pruned {pruned} image fingerprints older than {DEDUP_WINDOW:g} hours "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+    @prune_fingerprints.before_loop
+    async def before_prune_fingerprints(self) -> None:
+        await self.bot.warm.wait()
 
     @staticmethod
     def _extract_author_name(name: str) -> str | None:
@@ -28,181 +262,638 @@ class Network(commands.Cog):
             return match.group(1)
         return None
 
-    async def _is_send_user(
-        self, message: discord.Message, guild: Guild
-    ) -> tuple[discord.Member | None, bool]:
+    async def _resolve_author(self, guild: discord.Guild, name: str) -> discord.Member | None:
+        key = (guild.id, name)
+        try:
+            return self._authors[key]
+        except KeyError:
+            pass
+
+        authors = await guild.query_members(name)
+        author = authors[0] if authors else None
+        self._authors.set(key, author, ttl=None if author else AUTHOR_NEGATIVE_CACHE_TTL)
+        return author
+
+    async def _is_send_user(self, message: discord.Message) -> tuple[discord.Member | None, bool]:
         author = None
         if message.guild is None:
             return author, False
 
         if message.webhook_id is not None:
             # Embed Fixer compatibility
-            authors = await message.guild.query_members(
-                message.author.display_name.removesuffix(" (Embed Fixer)")
+            author = await self._resolve_author(
+                message.guild, message.author.display_name.removesuffix(" (Embed Fixer)")
             )
-            if not authors:
-                return author, False
-
-            author = authors[0]
-            if author.bot:
+            if author is None or author.bot:
                 return author, False
-            author_id = authors[0].id
+            author_id = author.id
         else:
             author_id = message.author.id
 
-        return author, author_id in guild.send_users
+        return author, ROUTES.is_send_user(message.guild.id, author_id)
 
-    async def _get_webhook(self, channel: discord.TextChannel) -> discord.Webhook:
-        webhooks = await channel.webhooks()
-        webhook_name = self.bot.user.name
-        webhook = discord.utils.get(webhooks, name=webhook_name)
-        if webhook is None:
-            webhook = await channel.create_webhook(
-                name=webhook_name, avatar=await self.bot.user.display_avatar.read()
+    async def _send_webhook_message(
+        self,
+        channel: discord.TextChannel,
+        *,
+        content: str,
+        username: str,
+        avatar_url: str,
+        files: FileFactory | None,
+    ) -> discord.WebhookMessage:
+        webhook = await self.webhooks.get(channel)
+        await self.ratelimits.wait(Route.WEBHOOK_SEND, webhook.id)
+        try:
+            return await webhook.send(
+                content=content,
+                username=username,
+                avatar_url=avatar_url,
+                files=await files() if files is not None else [],
+                wait=True,
             )
+        except discord.NotFound as e:
+            if e.code != UNKNOWN_WEBHOOK_RETCODE:
+                raise
+
+        # The cached webhook was deleted, get a new one and try again
+        await self.webhooks.invalidate(channel.id)
+        webhook = await self.webhooks.get(channel)
+        await self.ratelimits.wait(Route.WEBHOOK_SEND, webhook.id)
+        return await webhook.send(
+            content=content,
+            username=username,
+            avatar_url=avatar_url,
+            files=await files() if files is not None else [],
+            wait=True,
+        )
 
-        return webhook
-
-    async def _send_message(
+    @staticmethod
+    def _build_content(messages: list[discord.Message], urls: list[str]) -> str:
+        content = "\n".join(message.content for message in messages if message.content)
+        urls = [url for url in urls if url not in content]
+        if not urls:
+            return content
+        return "\n".join((content, *urls))
+
+    async def _send_message(  # noqa: PLR0913
         self,
         *,
         message: discord.Message,
         author: discord.Member | discord.User | None,
         guild: discord.Guild,
         channel: discord.VoiceChannel | discord.TextChannel | discord.StageChannel | discord.Thread,
-        files: list[discord.File],
+        content: str,
+        files: FileFactory | None,
     ) -> discord.Message:
-        if isinstance(channel, discord.TextChannel):
-            webhook = await self._get_webhook(channel)
-            author_name = message.author.name.removesuffix(" (Embed Fixer)")
-            author = author or message.author
-            return await webhook.send(
-                content=message.content,
-                username=f"{author_name} (來自:{guild.name})",
-                avatar_url=author.display_avatar.url,
-                files=files,
-                wait=True,
+        with METRICS.time("send"):
+            if isinstance(channel, discord.TextChannel):
+                author_name = message.author.name.removesuffix(" (Embed Fixer)")
+                author = author or message.author
+                return await self._send_webhook_message(
+                    channel,
+                    content=content,
+                    username=f"{author_name} (來自:{guild.name})",
+                    avatar_url=author.display_avatar.url,
+                    files=files,
+                )
+
+            await self.ratelimits.wait(Route.CHANNEL_SEND, channel.id)
+            return await channel.send(
+                content=f"(來自:{guild.name})\n{content}",
+                files=await files() if files is not None else [],
             )
 
-        return await channel.send(content=f"(來自:{guild.name})\n{message.content}", files=files)
+    async def _forward_to(
+        self,
+        messages: list[discord.Message],
+        *,
+        author: discord.Member | None,
+        attachments: AttachmentBundle,
+        receiver: tuple[int, int],
+        previous: dict[int, int],
+    ) -> list[MessageLink] | None:
+        async with self._forward_semaphore:
+            return await self._forward(
+                messages,
+                author=author,
+                attachments=attachments,
+                receiver=receiver,
+                previous=previous,
+            )
 
-    @commands.Cog.listener("on_message")
-    async def forward_medias(self, message: discord.Message) -> None:  # noqa: C901
-        if (
-            (not message.attachments and not any(ext in message.content for ext in MEDIA_EXTS))
-            or message.guild is None
-            or isinstance(
-                message.channel,
-                discord.DMChannel | discord.GroupChannel | discord.PartialMessageable,
+    async def _resolve_receiver(
+        self, receiver: tuple[int, int]
+    ) -> tuple[discord.Guild, ReceiverChannel]:
+        guild_id, channel_id = receiver
+        dc_guild = self.bot.get_guild(guild_id)
+        if dc_guild is not None:
+            channel = dc_guild.get_channel(channel_id) or await dc_guild.fetch_channel(channel_id)
+            return dc_guild, channel
+
+        # The guild is on a shard of another process, or this is a worker process
+        try:
+            return self._remote_receivers[channel_id]
+        except KeyError:
+            pass
+        dc_guild = await self._fetch_guild(guild_id)
+        channel = await dc_guild.fetch_channel(channel_id)
+        self._remote_receivers[channel_id] = (dc_guild, channel)
+        return dc_guild, channel
+
+    async def _fetch_guild(self, guild_id: int) -> discord.Guild:
+        dc_guild = self.bot.get_guild(guild_id)
+        if dc_guild is not None:
+            return dc_guild
+        try:
+            return self._remote_guilds[guild_id]
+        except KeyError:
+            pass
+        dc_guild = self._remote_guilds[guild_id] = await self.bot.fetch_guild(guild_id)
+        return dc_guild
+
+    async def _forward(
+        self,
+        messages: list[discord.Message],
+        *,
+        author: discord.Member | None,
+        attachments: AttachmentBundle,
+        receiver: tuple[int, int],
+        previous: dict[int, int],
+    ) -> list[MessageLink] | None:
+        """Forward a message, or a burst of messages from the same author, as one post.
+
+        Args:
+            previous: IDs of earlier copies of the same images in the receiver, by source
+                message ID, which are linked to instead of uploading the attachments again.
+        """
+        message = messages[0]
+        if message.guild is None:
+            return None
+
+        guild_id, channel_id = receiver
+        dc_guild, channel = await self._resolve_receiver(receiver)
+        if isinstance(channel, discord.ForumChannel | discord.CategoryChannel):
+            return None
+
+        copies = [
+            f"https://discord.com/channels/{guild_id}/{channel_id}/{previous[m.id]}"
+            for m in messages
+            if m.id in previous
+        ]
+        new = [a for m in messages if m.id not in previous for a in m.attachments]
+
+        # Attachments over the receiver's upload limit are recompressed or sent as links
+        uploads, links = attachments.plan(dc_guild.filesize_limit, new)
+        shrunk, links = await attachments.shrink(links, dc_guild.filesize_limit)
+        try:
+            sent_message = await self._send_message(
+                message=message,
+                author=author,
+                guild=message.guild,
+                channel=channel,
+                content=self._build_content(messages, [*(a.url for a in links), *copies]),
+                files=lambda: attachments.files(uploads, shrunk),
+            )
+        except discord.HTTPException as e:
+            if e.code != FILE_TOO_LARGE_RETCODE or not (uploads or shrunk):
+                raise
+
+            METRICS.inc("file_too_large")
+            sent_message = await self._send_message(
+                message=message,
+                author=author,
+                guild=message.guild,
+                channel=channel,
+                content=self._build_content(messages, [*(a.url for a in new), *copies]),
+                files=None,
+            )
+
+        return await self._finish_forward(messages, author=author, sent_message=sent_message)
+
+    async def _finish_forward(
+        self,
+        messages: list[discord.Message],
+        *,
+        author: discord.Member | None,
+        sent_message: discord.Message,
+    ) -> list[MessageLink]:
+        # Every source message of a burst is linked, so deleting any of them deletes the copy
+        message_links = [
+            MessageLink(
+                message_id=sent_message.id,
+                channel_id=sent_message.channel.id,
+                source_id=message.id,
+                webhook_id=sent_message.webhook_id,
+                author_id=(author or message.author).id,
             )
-            or (message.author.bot and message.webhook_id is None)
+            for message in messages
+        ]
+        # Saved right away, so a retry or a resumed delivery skips this receiver and the
+        # copy can be deleted whatever happens to the rest of the delivery
+        with METRICS.time("persist"):
+            await MessageLink.bulk_create(message_links)
+
+        await self.ratelimits.wait(Route.REACTION, sent_message.channel.id)
+        try:
+            await sent_message.add_reaction("❌")
+        except discord.HTTPException as e:
+            if isinstance(e, discord.Forbidden):
+                METRICS.inc("forbidden", action="react")
+            logger.warning(f"Failed to add the delete reaction to message {sent_message.id}: {e}")
+        return message_links
+
+    @commands.Cog.listener("on_message")
+    async def forward_medias(self, message: discord.Message) -> None:
+        if not ROUTES.loaded:
+            # There was no snapshot to restore, wait for the routes to load
+            await self.bot.warm.wait()
+
+        # Synchronous checks first, most messages can never be forwarded
+        if message.channel.id not in ROUTES.sender_channels or (
+            not message.attachments and MEDIA_PATTERN.search(message.content) is None
         ):
             return
 
-        guild = await Guild.get_or_none(id=message.guild.id)
-        if guild is None:
-            return
+        with METRICS.time("filter"):
+            if (
+                message.guild is None
+                or isinstance(
+                    message.channel,
+                    discord.DMChannel | discord.GroupChannel | discord.PartialMessageable,
+                )
+                or (message.author.bot and message.webhook_id is None)
+            ):
+                return
 
-        # Is sender?
-        senders = await guild.get_senders()
-        if message.channel.id not in senders:
-            return
+            # Is sender?
+            if ROUTES.sender_guild(message.channel.id) != message.guild.id:
+                return
 
-        # Is send user?
-        author, is_send_user = await self._is_send_user(message, guild)
-        if not is_send_user:
-            return
+            # Is send user?
+            author, is_send_user = await self._is_send_user(message)
+            if not is_send_user:
+                return
 
         # Send to other guilds
         is_nsfw = message.channel.is_nsfw()
-        guilds = await Guild.all()
+        if not await self._get_receivers(nsfw=is_nsfw, exclude_guild=message.guild.id):
+            return
 
-        for guild in guilds:
-            if guild.id == message.guild.id:
-                continue
+        if self.bursts is not None:
+            self.bursts.add(message, author)
+        else:
+            await self._queue_delivery([(message, author)])
+
+    async def _queue_delivery(
+        self, messages: list[tuple[discord.Message, discord.Member | None]]
+    ) -> None:
+        message, author = messages[0]
+        channel = message.channel
+        if message.guild is None or isinstance(
+            channel, discord.DMChannel | discord.GroupChannel | discord.PartialMessageable
+        ):
+            return
 
-            receiver = await guild.get_receiver(nsfw=is_nsfw)
-            if receiver is None:
-                continue
+        # Handed to the delivery without refetching when it's processed by this process
+        if ROLE == "all":
+            self._pending.update((m.id, (m, a)) for m, a in messages)
+        for merged, _ in messages[1:]:
+            self._burst_of[merged.id] = message.id
+        await self.deliveries.put(
+            Delivery(
+                id=message.id,
+                guild_id=message.guild.id,
+                channel_id=channel.id,
+                author_id=(author or message.author).id,
+                nsfw=channel.is_nsfw(),
+                merged_ids=[m.id for m, _ in messages[1:]],
+            )
+        )
+
+    async def _get_receivers(self, *, nsfw: bool, exclude_guild: int) -> list[tuple[int, int]]:
+        with METRICS.time("route"):
+            if ROUTES.loaded:
+                return ROUTES.receivers(nsfw=nsfw, exclude_guild=exclude_guild)
+            return await Channel.receivers_for(nsfw=nsfw, exclude_guild=exclude_guild)
+
+    async def _fetch_pending(
+        self, delivery: Delivery, message_id: int
+    ) -> tuple[discord.Message, discord.Member | None] | None:
+        """Fetch a source message of a delivery that was queued before a restart or by
+        a gateway process.
+        """
+        if not ROUTES.is_send_user(delivery.guild_id, delivery.author_id):
+            return None
+
+        channel = self.bot.get_partial_messageable(delivery.channel_id, guild_id=delivery.guild_id)
+        try:
+            message = await channel.fetch_message(message_id)
+        except discord.NotFound:
+            return None
 
-            dc_guild = self.bot.get_guild(guild.id) or await self.bot.fetch_guild(guild.id)
-            channel = dc_guild.get_channel(receiver) or await dc_guild.fetch_channel(receiver)
-            if isinstance(channel, discord.ForumChannel | discord.CategoryChannel):
+        # Worker processes have no guild cache
+        guild = message.guild = message.guild or await self._fetch_guild(delivery.guild_id)
+        if message.webhook_id is None:
+            return message, None
+
+        # The Embed Fixer author was resolved when the delivery was queued
+        try:
+            author = guild.get_member(delivery.author_id) or await guild.fetch_member(
+                delivery.author_id
+            )
+        except discord.NotFound:
+            return None
+        return message, author
+
+    async def _take_pending(
+        self, delivery: Delivery, message_id: int
+    ) -> tuple[discord.Message, discord.Member | None] | None:
+        return self._pending.pop(message_id, None) or await self._fetch_pending(
+            delivery, message_id
+        )
+
+    async def _find_previous_copies(
+        self, message: discord.Message, attachments: AttachmentBundle
+    ) -> dict[int, int] | None:
+        """Check whether the images of a message were already forwarded.
+
+        Returns:
+            The earlier copies to link to, by receiver channel ID, or `None` if the
+            message should be skipped.
+        """
+        if self.dedup is None or not all(is_image(a) for a in message.attachments):
+            return {}
+
+        images = await asyncio.gather(*(attachments.read(a) for a in message.attachments))
+        matches = await self.dedup.check(message.id, list(images))
+        if not matches or None in matches:
+            return {}
+
+        if DEDUP_MODE == "skip":
+            logger.info(f"Skipped message {message.id}, duplicate of {set(matches)}")
+            return None
+        # Linking to an earlier copy only works if it has every image
+        duplicate_of = matches[0]
+        if any(match != duplicate_of for match in matches):
+            return {}
+        return dict(
+            await MessageLink.filter(source_id=duplicate_of).values_list("channel_id", "message_id")
+        )
+
+    async def _find_duplicates(
+        self, messages: list[discord.Message], attachments: AttachmentBundle
+    ) -> tuple[list[discord.Message], dict[int, dict[int, int]]]:
+        """Check which messages of a delivery were already forwarded.
+
+        Returns:
+            The messages that aren't skipped, and the earlier copies to link to by source
+            message ID and receiver channel ID.
+        """
+        kept: list[discord.Message] = []
+        previous: dict[int, dict[int, int]] = {}
+        for message in messages:
+            copies = await self._find_previous_copies(message, attachments)
+            if copies is None:
                 continue
+            kept.append(message)
+            if copies:
+                previous[message.id] = copies
+        return kept, previous
 
-            files = [
-                await attachment.to_file(spoiler=attachment.is_spoiler())
-                for attachment in message.attachments
-            ]
-            try:
-                sent_message = await self._send_message(
-                    message=message,
-                    author=author,
-                    guild=message.guild,
-                    channel=channel,
-                    files=files,
+    @staticmethod
+    def _collect_results(
+        message: discord.Message,
+        receivers: list[tuple[int, int]],
+        results: list[list[MessageLink] | BaseException | None],
+    ) -> bool:
+        """Log the failed forwards of a delivery.
+
+        Returns:
+            Whether no receiver needs a retry.
+        """
+        done = True
+        for (_, channel_id), result in zip(receivers, results, strict=True):
+            if isinstance(result, discord.Forbidden | discord.NotFound):
+                # Retrying won't help, the receiver needs to fix its permissions or settings
+                if isinstance(result, discord.Forbidden):
+                    METRICS.inc("forbidden", action="forward")
+                logger.error(f"Failed to forward message {message.id} to {channel_id=}: {result}")
+            elif isinstance(result, BaseException):
+                logger.opt(exception=result).error(
+                    f"Failed to forward message {message.id} to {channel_id=}"
                 )
-            except discord.HTTPException as e:
-                if e.code != FILE_TOO_LARGE_RETCODE:
-                    raise
+                done = False
+        return done
+
+    async def _deliver(self, delivery: Delivery) -> bool:
+        """Forward a queued message, or burst of messages, to the receivers that haven't
+        got it yet.
+
+        Returns:
+            Whether the delivery is done, failed receivers are retried otherwise.
+        """
+        if delivery.deleted:
+            return True
+        if ROLE == "all":
+            await self.bot.wait_until_ready()
+
+        message_ids = [delivery.id, *delivery.merged_ids]
+        pending = [
+            p
+            for p in await asyncio.gather(
+                *(self._take_pending(delivery, message_id) for message_id in message_ids)
+            )
+            if p is not None
+        ]
+        if not pending:
+            return True
+        messages = [message for message, _ in pending]
+        author = next((author for _, author in pending if author is not None), None)
+
+        receivers = await self._get_receivers(nsfw=delivery.nsfw, exclude_guild=delivery.guild_id)
+        # Skip the receivers reached before a crash or a retry, even on the first attempt
+        # since a resumed job may not have had its attempts saved
+        delivered = set(
+            await MessageLink.filter(source_id__in=message_ids).values_list("channel_id", flat=True)
+        )
+        receivers = [receiver for receiver in receivers if receiver[1] not in delivered]
+        if not receivers:
+            return True
+
+        start = time.perf_counter()
+        async with AttachmentBundle(
+            [a for message in messages for a in message.attachments],
+            recompressor=self.recompressor,
+            spooler=self.spooler,
+        ) as attachments:
+            # The first attempt already recorded the images in the dedup index
+            previous: dict[int, dict[int, int]] = {}
+            if not delivery.attempts:
+                messages, previous = await self._find_duplicates(messages, attachments)
+                if not messages:
+                    return True
+
+            results = await asyncio.gather(
+                *(
+                    self._forward_to(
+                        messages,
+                        author=author,
+                        attachments=attachments,
+                        receiver=receiver,
+                        previous={
+                            message_id: copies[receiver[1]]
+                            for message_id, copies in previous.items()
+                            if receiver[1] in copies
+                        },
+                    )
+                    for receiver in receivers
+                ),
+                return_exceptions=True,
+            )
 
-                attachment_urls = "\n".join(
-                    a.url for a in message.attachments if a.url not in message.content
-                )
-                message.content += f"\n{attachment_urls}"
-                sent_message = await self._send_message(
-                    message=message, author=author, guild=message.guild, channel=channel, files=[]
-                )
+        message = messages[0]
+        done = self._collect_results(message, receivers, results)
+        # A source deleted during the fan-out may have had its links looked up before these
+        # copies were linked
+        if await Delivery.filter(id=delivery.id, deleted=True).exists():
+            logger.info(f"Message {delivery.id} was deleted while it was forwarded")
+            for message_id in message_ids:
+                await self._delete_message_links(message_id)
+            return True
+        elapsed = time.perf_counter() - start
+        METRICS.observe("deliver", elapsed)
+        if len(messages) > 1:
+            METRICS.inc("coalesced", len(messages) - 1)
+        forwarded = sum(isinstance(result, list) for result in results)
+        merged = f" and {len(messages) - 1} merged messages" if len(messages) > 1 else ""
+        logger.info(
+            f"Forwarded message {message.id}{merged} to {forwarded}/{len(receivers)} receivers "
+            f"in {elapsed:.2f}s"
+        )
+        return done
 
-            await sent_message.add_reaction("❌")
+    @commands.Cog.listener("on_webhooks_update")
+    async def invalidate_webhook(self, channel: discord.abc.GuildChannel) -> None:
+        await self.webhooks.updated(channel.id)
 
-            await MessageLink.create(
-                id=sent_message.id, channel_id=channel.id, source_id=message.id
-            )
+    async def _delete_copy(self, message_link: MessageLink) -> bool:
+        """Delete a forwarded copy, returns whether it no longer exists."""
+        webhook = self.webhooks.get_cached(message_link.channel_id)
+        if webhook is None or webhook.id != message_link.webhook_id:
+            webhook = None
+
+        async with self._delete_semaphore:
+            try:
+                if webhook is not None:
+                    await self.ratelimits.wait(Route.WEBHOOK_DELETE, webhook.id)
+                    await webhook.delete_message(message_link.message_id)
+                else:
+                    await self.ratelimits.wait(Route.CHANNEL_DELETE, message_link.channel_id)
+                    channel = self.bot.get_partial_messageable(message_link.channel_id)
+                    await channel.get_partial_message(message_link.message_id).delete()
+            except discord.NotFound:
+                return True
+            except discord.Forbidden:
+                METRICS.inc("forbidden", action="delete")
+                logger.error(f"Failed to delete message in channel_id={message_link.channel_id}")
+                return False
+            except discord.HTTPException:
+                logger.exception(f"Failed to delete message {message_link.message_id}")
+                return False
+            return True
 
     @commands.Cog.listener("on_raw_message_delete")
     async def delete_message_links(self, payload: discord.RawMessageDeleteEvent) -> None:
         message_id = payload.message_id
         logger.info(f"Noticed message {message_id} deleted")
+        if payload.channel_id in ROUTES.sender_channels:
+            await self._cancel_delivery(payload.channel_id, message_id)
+        if ROLE == "gateway":
+            if await MessageLink.filter(source_id=message_id).exists():
+                await self.deletions.put(Deletion(id=message_id))
+            return
+        await self._delete_message_links(message_id)
+
+    async def _cancel_delivery(self, channel_id: int, message_id: int) -> None:
+        """Keep a deleted source message from being forwarded, or its copies from being
+        kept if its delivery is already in progress.
+        """
+        # Refetched instead, which finds that it was deleted
+        self._pending.pop(message_id, None)
+        if self.bursts is not None and self.bursts.discard(channel_id, message_id):
+            return
 
+        try:
+            delivery_id = self._burst_of[message_id]
+        except KeyError:
+            delivery_id = message_id
+        await Delivery.filter(id=delivery_id).update(deleted=True)
+
+    async def _process_deletion(self, deletion: Deletion) -> bool:
+        if deletion.user_id is None:
+            await self._delete_message_links(deletion.id)
+            return True
+
+        message_link = await MessageLink.filter(message_id=deletion.id).first()
+        if message_link is not None:
+            await self._delete_reacted_copy(message_link, deletion.user_id)
+        return True
+
+    async def _delete_message_links(self, message_id: int) -> None:
         message_links = await MessageLink.filter(source_id=message_id)
         logger.info(f"Found {len(message_links)} message links")
 
-        for message_link in message_links:
-            channel = self.bot.get_partial_messageable(message_link.channel_id)
+        results = await asyncio.gather(*(self._delete_copy(link) for link in message_links))
+        deleted = [link.message_id for link, ok in zip(message_links, results, strict=True) if ok]
+        if deleted:
+            # Also removes the links of the other messages of a burst to the deleted copies
+            await MessageLink.filter(message_id__in=deleted).delete()
 
-            try:
-                await channel.get_partial_message(message_link.id).delete()
-            except discord.NotFound:
-                pass
-            except discord.Forbidden:
-                logger.error(f"Failed to delete message in {channel.id=}")
-            else:
-                await message_link.delete()
+    async def _is_legacy_link_author(self, message_link: MessageLink, user_id: int) -> bool:
+        """Authorize links created before the author ID was stored on them."""
+        message = await self.bot.get_partial_messageable(message_link.channel_id).fetch_message(
+            message_link.message_id
+        )
+        author = await self.bot.fetch_user(user_id)
+        author_name = self._extract_author_name(message.author.name)
+        return author_name is not None and author_name == author.name
 
     @commands.Cog.listener("on_raw_reaction_add")
     async def delete_message_on_reaction(self, reaction: discord.RawReactionActionEvent) -> None:
-        if str(reaction.emoji) != "❌":
+        if str(reaction.emoji) != "❌" or reaction.user_id == self.bot.user.id:
             return
 
-        message = await self.bot.get_partial_messageable(reaction.channel_id).fetch_message(
-            reaction.message_id
-        )
-        author = await self.bot.fetch_user(reaction.user_id)
-        author_name = self._extract_author_name(message.author.name)
+        message_link = await MessageLink.filter(message_id=reaction.message_id).first()
+        if message_link is None or message_link.author_id not in {None, reaction.user_id}:
+            return
 
-        if author_name is None or author_name != author.name:
+        if ROLE == "gateway":
+            # Legacy links are authorized by the worker, which makes the requests
+            if not await Deletion.filter(id=reaction.message_id).exists():
+                await self.deletions.put(Deletion(id=reaction.message_id, user_id=reaction.user_id))
             return
+        await self._delete_reacted_copy(message_link, reaction.user_id)
 
+    async def _delete_reacted_copy(self, message_link: MessageLink, user_id: int) -> None:
+        if message_link.author_id is None and not await self._is_legacy_link_author(
+            message_link, user_id
+        ):
+            return
+
+        channel = self.bot.get_partial_messageable(message_link.channel_id)
+        await self.ratelimits.wait(Route.CHANNEL_DELETE, message_link.channel_id)
         try:
-            await message.delete()
+            await channel.get_partial_message(message_link.message_id).delete()
         except discord.NotFound:
             pass
         except discord.Forbidden:
-            await message.channel.send(
-                f"無法刪除 {message.author.mention} 的訊息, "
-                f"請檢查 {self.bot.user.mention} 是否有管理訊息的權限"
+            METRICS.inc("forbidden", action="delete")
+            await channel.send(
+                f"無法刪除 <@{user_id}> 的訊息, 請檢查 {self.bot.user.mention} 是否有管理訊息的權限"
             )
+            return
+
+        await MessageLink.filter(message_id=message_link.message_id).delete()
 
 
 async def setup(bot: WocardoBot) -> None:
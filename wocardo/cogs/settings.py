@@ -28,6 +28,7 @@ class Settings(commands.Cog):
         senders = await guild.get_senders()
         nsfw_receiver = await guild.get_receiver(nsfw=True)
         regular_receiver = await guild.get_receiver(nsfw=False)
+        send_users = await guild.get_send_users()
 
         embed = DefaultEmbed(title="設置總覽")
         embed.add_field(
@@ -47,7 +48,7 @@ class Settings(commands.Cog):
         )
         embed.add_field(
             name="發送人",
-            value=" ".join(f"<@{user_id}>" for user_id in guild.send_users) or "尚未設置",
+            value=" ".join(f"<@{user_id}>" for user_id in send_users) or "尚未設置",
             inline=False,
         )
 
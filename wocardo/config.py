@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FORWARD_CONCURRENCY = int(os.getenv("FORWARD_CONCURRENCY", "10"))
+"""Maximum number of receivers a message is forwarded to at the same time."""
+DELETE_CONCURRENCY = int(os.getenv("DELETE_CONCURRENCY", "10"))
+"""Maximum number of forwarded copies deleted at the same time."""
+
+AUTHOR_CACHE_SIZE = int(os.getenv("AUTHOR_CACHE_SIZE", "1024"))
+"""Maximum number of Embed Fixer authors kept in the author cache."""
+AUTHOR_CACHE_TTL = float(os.getenv("AUTHOR_CACHE_TTL", "600"))
+"""Seconds a resolved Embed Fixer author is cached for, and so stays stale after a rename."""
+AUTHOR_NEGATIVE_CACHE_TTL = float(os.getenv("AUTHOR_NEGATIVE_CACHE_TTL", "60"))
+"""Seconds a display name that didn't resolve to a member is cached for."""
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+"""Number of workers draining the delivery queue."""
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+"""Number of attempts after which a delivery is dropped."""
+DELIVERY_RETRY_DELAY = float(os.getenv("DELIVERY_RETRY_DELAY", "5"))
+"""Seconds before the first retry of a failed delivery, doubled on every attempt."""
+
+MEDIA_RECOMPRESS = os.getenv("MEDIA_RECOMPRESS", "0") == "1"
+"""Whether to recompress images that are over a receiver's upload limit, requires Pillow."""
+MEDIA_RECOMPRESS_WORKERS = int(os.getenv("MEDIA_RECOMPRESS_WORKERS", "2"))
+"""Number of processes used to recompress images."""
+MEDIA_STREAM_THRESHOLD = int(os.getenv("MEDIA_STREAM_THRESHOLD", str(8 * 1024 * 1024)))
+"""Bytes over which an attachment is relayed through a temporary file instead of memory."""
+MEDIA_MEMORY_LIMIT = int(os.getenv("MEDIA_MEMORY_LIMIT", str(256 * 1024 * 1024)))
+"""Bytes of attachments the process holds in memory at once, the rest go through files."""
+
+DEDUP_MODE = os.getenv("DEDUP_MODE", "off")
+"""What to do with reposted images: 'off', 'skip' them or 'link' to the earlier copy."""
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "24"))
+"""Hours an image is remembered for when looking for reposts."""
+DEDUP_THRESHOLD = int(os.getenv("DEDUP_THRESHOLD", "6"))
+"""Maximum Hamming distance between perceptual hashes of near-duplicate images."""
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "4096"))
+"""Maximum number of fingerprints kept in memory."""
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+"""Seconds an author's uploads in a sender are gathered for to be forwarded as one post,
+0 to forward every message on its own."""
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+"""Port of the local Prometheus metrics endpoint, metrics are disabled if 0.
+Each cluster and worker process serves on the next port."""
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+"""Address the metrics endpoint listens on."""
+
+CLUSTER_COUNT = int(os.getenv("CLUSTER_COUNT", "1"))
+"""Number of processes the shards are spread across, 1 to run a single process."""
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+"""Total number of shards in cluster mode, 0 to use the count recommended by Discord."""
+CLUSTER_SYNC_PORT = int(os.getenv("CLUSTER_SYNC_PORT", "47100"))
+"""First local UDP port used to propagate routing changes when the database isn't Postgres."""
+
+ROLE = os.getenv("ROLE", "all")
+"""What this process does: 'all', 'gateway' to only queue jobs, or 'worker' to process them."""
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1"))
+"""Seconds between polls of the job queues when a worker is idle."""
+WORKER_LEASE = float(os.getenv("WORKER_LEASE", "300"))
+"""Seconds a worker holds a job for before another worker may retry it."""
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+"""Number of worker processes, so routing changes reach them when the database isn't Postgres."""
+
+LINK_RETENTION_DAYS = float(os.getenv("LINK_RETENTION_DAYS", "0"))
+"""Days the links to forwarded copies are kept for, 0 to keep them forever."""
+LINK_PRUNE_BATCH = int(os.getenv("LINK_PRUNE_BATCH", "1000"))
+"""Maximum number of rows deleted by a single query when pruning links or fingerprints."""
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+"""File the gateway events handled by the network cog are recorded to, for offline replays.
+Disabled if empty, compressed if it ends in '.gz'."""
+
+ROUTES_SNAPSHOT = os.getenv("ROUTES_SNAPSHOT", "routes_snapshot.json")
+"""File the routing table is saved to, so it can be used on startup before the database is."""
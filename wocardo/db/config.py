@@ -6,8 +6,10 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+DATABASE_URI = os.getenv("DATABASE_URI") or "sqlite://db.sqlite3"
+
 TORTOISE_ORM = {
-    "connections": {"default": os.getenv("DATABASE_URI") or "sqlite://db.sqlite3"},
+    "connections": {"default": DATABASE_URI},
     "apps": {
         "models": {
             "models": ["wocardo.db.models", "aerich.models"],
@@ -2,11 +2,14 @@
 
 from __future__ import annotations
 
+import asyncio
 from enum import StrEnum
 
 from tortoise import fields
 from tortoise.models import Model
 
+from wocardo.db.routing import ROUTES, GuildRoute
+
 
 class ChannelType(StrEnum):
     NSFW_RECEIVE = " NSFW 接收站"
@@ -30,10 +33,21 @@ class Channel(BaseModel):
     guild: fields.ForeignKeyRelation[Guild] = fields.ForeignKeyField(
         "models.Guild", related_name="channels"
     )
+    guild_id: int
     type = fields.CharEnumField(ChannelType)
 
     class Meta:
         unique_together = ("channel_id", "type")
+        indexes = (("type", "guild_id"),)
+
+    @classmethod
+    async def receivers_for(cls, *, nsfw: bool, exclude_guild: int) -> list[tuple[int, int]]:
+        """Return the (guild_id, channel_id) pairs that should receive a forwarded message."""
+        return await (
+            cls.filter(type=ChannelType.NSFW_RECEIVE if nsfw else ChannelType.REGULAR_RECEIVE)
+            .exclude(guild_id=exclude_guild)
+            .values_list("guild_id", "channel_id")
+        )
 
 
 class Guild(BaseModel):
@@ -44,7 +58,72 @@ class Guild(BaseModel):
     """
 
     id = fields.BigIntField(pk=True, generated=False)
-    send_users: fields.Field[list[int]] = fields.JSONField(default=[])
+    send_users: fields.ReverseRelation[SendUser]
+
+    @staticmethod
+    def _build_routes(
+        guilds: list[Guild], channels: list[Channel], send_users: list[tuple[int, int]]
+    ) -> dict[int, GuildRoute]:
+        routes = {guild.id: GuildRoute() for guild in guilds}
+        for guild_id, user_id in send_users:
+            routes.setdefault(guild_id, GuildRoute()).send_users.add(user_id)
+        for channel in channels:
+            route = routes.setdefault(channel.guild_id, GuildRoute())
+            if channel.type is ChannelType.SEND:
+                route.senders.add(channel.channel_id)
+            elif channel.type is ChannelType.NSFW_RECEIVE:
+                route.nsfw_receiver = channel.channel_id
+            else:
+                route.regular_receiver = channel.channel_id
+        return routes
+
+    @classmethod
+    async def fetch_routes(cls) -> dict[int, GuildRoute]:
+        return cls._build_routes(
+            await cls.all(),
+            await Channel.all(),
+            await SendUser.all().values_list("guild_id", "user_id"),
+        )
+
+    @classmethod
+    async def load_routes(cls) -> None:
+        ROUTES.replace(await cls.fetch_routes())
+
+    @classmethod
+    async def reload_route(cls, guild_id: int) -> None:
+        """Reload the routes of a guild that was changed by another process."""
+        while True:
+            version = ROUTES.version
+            routes = cls._build_routes(
+                await cls.filter(id=guild_id),
+                await Channel.filter(guild_id=guild_id),
+                await SendUser.filter(guild_id=guild_id).values_list("guild_id", "user_id"),
+            )
+            # Fetched again if this process changed the guild in the meantime
+            if not ROUTES.changed_since(guild_id, version):
+                break
+        ROUTES.update(guild_id, routes.get(guild_id))
+
+    @classmethod
+    async def check_routes(cls) -> list[int]:
+        """Reload the routes of the guilds whose rows were changed outside the bot.
+
+        Guilds changed while the rows were being fetched are left as they are, the
+        fetched rows may predate the change. They are compared again on the next check.
+
+        Returns:
+            The IDs of the guilds whose routes were out of sync.
+        """
+        version = ROUTES.version
+        routes = await cls.fetch_routes()
+        stale = [
+            guild_id
+            for guild_id in ROUTES.diff(routes)
+            if not ROUTES.changed_since(guild_id, version)
+        ]
+        for guild_id in stale:
+            ROUTES.update(guild_id, routes.get(guild_id))
+        return stale
 
     async def remove_receiver(self, *, nsfw: bool) -> int | None:
         channel = await Channel.get_or_none(
@@ -53,6 +132,7 @@ class Guild(BaseModel):
         if channel is None:
             return None
         await channel.delete()
+        ROUTES.set_receiver(self.id, None, nsfw=nsfw)
         return channel.channel_id
 
     async def set_receiver(self, channel_id: int, *, nsfw: bool) -> None:
@@ -62,6 +142,7 @@ class Guild(BaseModel):
             channel_id=channel_id,
             type=ChannelType.NSFW_RECEIVE if nsfw else ChannelType.REGULAR_RECEIVE,
         )
+        ROUTES.set_receiver(self.id, channel_id, nsfw=nsfw)
 
     async def get_receiver(self, *, nsfw: bool) -> int | None:
         channel = await Channel.get_or_none(
@@ -71,6 +152,7 @@ class Guild(BaseModel):
 
     async def add_sender(self, channel_id: int) -> None:
         await Channel.get_or_create(guild_id=self.id, channel_id=channel_id, type=ChannelType.SEND)
+        ROUTES.add_sender(self.id, channel_id)
 
     async def remove_sender(self, channel_id: int) -> int | None:
         channel = await Channel.get_or_none(
@@ -79,6 +161,7 @@ class Guild(BaseModel):
         if channel is None:
             return None
         await channel.delete()
+        ROUTES.remove_sender(self.id, channel_id)
         return channel.channel_id
 
     async def get_senders(self) -> list[int]:
@@ -87,21 +170,120 @@ class Guild(BaseModel):
             for channel in await Channel.filter(guild_id=self.id, type=ChannelType.SEND)
         ]
 
+    async def get_send_users(self) -> list[int]:
+        return await SendUser.filter(guild_id=self.id).values_list("user_id", flat=True)
+
     async def add_send_user(self, user_id: int) -> None:
-        self.send_users.append(user_id)
-        self.send_users = list(set(self.send_users))
-        await self.save(update_fields=("send_users",))
+        await SendUser.get_or_create(guild_id=self.id, user_id=user_id)
+        ROUTES.add_send_user(self.id, user_id)
 
     async def remove_send_user(self, user_id: int) -> int | None:
-        if user_id not in self.send_users:
+        if not await SendUser.filter(guild_id=self.id, user_id=user_id).delete():
             return None
-
-        self.send_users.remove(user_id)
-        await self.save(update_fields=("send_users",))
+        ROUTES.remove_send_user(self.id, user_id)
         return user_id
 
 
-class MessageLink(BaseModel):
+class SendUser(BaseModel):
+    """A user whose images are forwarded when posted in the guild's senders."""
+
+    guild: fields.ForeignKeyRelation[Guild] = fields.ForeignKeyField(
+        "models.Guild", related_name="send_users"
+    )
+    guild_id: int
+    user_id = fields.BigIntField()
+
+    class Meta:
+        unique_together = ("guild_id", "user_id")
+
+
+class PrunedModel(BaseModel):
+    """Rows about a message, which are only kept for some time after it was sent."""
+
+    @classmethod
+    async def prune(cls, before: int, *, batch_size: int, pause: float = 0.1) -> int:
+        """Delete the rows whose `message_id` is older than a snowflake ID.
+
+        Rows are deleted in batches with a pause in between, so no query holds its locks
+        for long.
+
+        Returns:
+            The number of deleted rows.
+        """
+        pruned = 0
+        while True:
+            ids = (
+                await cls.filter(message_id__lt=before)
+                .order_by("message_id")
+                .limit(batch_size)
+                .values_list("id", flat=True)
+            )
+            if ids:
+                pruned += await cls.filter(id__in=ids).delete()
+            if len(ids) < batch_size:
+                return pruned
+            await asyncio.sleep(pause)
+
+    class Meta:
+        abstract = True
+
+
+class MessageLink(PrunedModel):
+    """Links a forwarded copy to a source message, a copy of a burst has several links."""
+
+    id = fields.BigIntField(pk=True)
+    message_id = fields.BigIntField(db_index=True)
+    channel_id = fields.BigIntField()
+    source_id = fields.BigIntField(db_index=True)
+    webhook_id = fields.BigIntField(null=True)
+    author_id = fields.BigIntField(null=True)
+
+
+class ChannelWebhook(BaseModel):
+    """The webhook the bot uses to forward messages to a receiver channel."""
+
+    channel_id = fields.BigIntField(pk=True, generated=False)
+    webhook_id = fields.BigIntField()
+    token = fields.CharField(max_length=100)
+
+
+class QueuedJob(BaseModel):
+    attempts = fields.IntField(default=0)
+    # Until when a worker process holds the job, or when it is due to be retried
+    locked_until = fields.DatetimeField(null=True)
+
+    class Meta:
+        abstract = True
+
+
+class Delivery(QueuedJob):
+    """A message waiting in the outbound delivery queue."""
+
     id = fields.BigIntField(pk=True, generated=False)
+    guild_id = fields.BigIntField()
     channel_id = fields.BigIntField()
-    source_id = fields.BigIntField()
+    author_id = fields.BigIntField()
+    nsfw = fields.BooleanField()
+    # The following messages of a burst, forwarded in the same post as this one
+    merged_ids: fields.Field[list[int]] = fields.JSONField(default=[])
+    # Set when a source message is deleted while the delivery is queued or in progress
+    deleted = fields.BooleanField(default=False)
+
+
+class Deletion(QueuedJob):
+    """A deleted message whose forwarded copies are waiting to be deleted, or a forwarded
+    copy its author reacted to with ❌.
+    """
+
+    id = fields.BigIntField(pk=True, generated=False)
+    # The user who reacted, set when the job is keyed by a forwarded copy
+    user_id = fields.BigIntField(null=True)
+
+
+class MediaHash(PrunedModel):
+    """Fingerprint of an image forwarded to the network, used to skip reposts."""
+
+    id = fields.IntField(pk=True)
+    digest = fields.CharField(max_length=64, db_index=True)
+    phash = fields.BigIntField(null=True)
+    message_id = fields.BigIntField(db_index=True)
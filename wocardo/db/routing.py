@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import json
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+@dataclass(slots=True)
+class GuildRoute:
+    senders: set[int] = field(default_factory=set)
+    regular_receiver: int | None = None
+    nsfw_receiver: int | None = None
+    send_users: set[int] = field(default_factory=set)
+
+
+class RoutingTable:
+    """In-memory copy of the network's routing rows.
+
+    Loaded once on startup and updated in place by the mutating methods of `Guild`,
+    so the forwarding hot path never has to touch the database.
+    """
+
+    def __init__(self) -> None:
+        self._guilds: dict[int, GuildRoute] = {}
+        self._sender_guilds: dict[int, int] = {}
+        self.sender_channels: frozenset[int] = frozenset()
+        """IDs of every sender channel, for checks that must not await."""
+        self._receivers: dict[bool, tuple[tuple[int, int], ...]] = {}
+        self._listeners: list[Callable[[int], object]] = []
+        self.loaded = False
+        self.version = 0
+        """Incremented by every change, see `changed_since`."""
+        self._versions: dict[int, int] = {}
+        self._replaced = 0
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    def _invalidate(self) -> None:
+        self._receivers.clear()
+
+    def subscribe(self, listener: Callable[[int], object]) -> None:
+        """Call a listener with the guild ID whenever a mutating method changes a route."""
+        self._listeners.append(listener)
+
+    def _touch(self, guild_id: int) -> None:
+        self.version += 1
+        self._versions[guild_id] = self.version
+
+    def changed_since(self, guild_id: int, version: int) -> bool:
+        """Return whether the routes of a guild changed after `version` was read."""
+        return self._versions.get(guild_id, self._replaced) > version
+
+    def _changed(self, guild_id: int) -> None:
+        self._touch(guild_id)
+        for listener in self._listeners:
+            listener(guild_id)
+
+    def replace(self, guilds: dict[int, GuildRoute]) -> None:
+        self._guilds = guilds
+        self._sender_guilds = {
+            channel_id: guild_id
+            for guild_id, route in guilds.items()
+            for channel_id in route.senders
+        }
+        self.sender_channels = frozenset(self._sender_guilds)
+        self._invalidate()
+        self.version += 1
+        self._versions.clear()
+        self._replaced = self.version
+        self.loaded = True
+
+    def save(self, path: Path) -> None:
+        """Write the table to a snapshot file, restored on the next start."""
+        data = {
+            str(guild_id): {
+                "senders": sorted(route.senders),
+                "regular_receiver": route.regular_receiver,
+                "nsfw_receiver": route.nsfw_receiver,
+                "send_users": sorted(route.send_users),
+            }
+            for guild_id, route in self._guilds.items()
+        }
+        # Each process writes its own temporary file, the last one to finish wins
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+        ) as file:
+            temp = Path(file.name)
+            try:
+                file.write(json.dumps(data))
+            except BaseException:
+                temp.unlink()
+                raise
+        temp.replace(path)
+
+    def restore(self, path: Path) -> bool:
+        """Load the table from a snapshot file, returns whether a valid one was loaded."""
+        try:
+            data = json.loads(path.read_text())
+            guilds = {
+                int(guild_id): GuildRoute(
+                    senders=set(route["senders"]),
+                    regular_receiver=route["regular_receiver"],
+                    nsfw_receiver=route["nsfw_receiver"],
+                    send_users=set(route["send_users"]),
+                )
+                for guild_id, route in data.items()
+            }
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            # The routes are loaded from the database anyway
+            logger.warning(f"Ignoring invalid routes snapshot {path}: {error!r}")
+            return False
+
+        self.replace(guilds)
+        return True
+
+    def diff(self, guilds: dict[int, GuildRoute]) -> list[int]:
+        """Return the IDs of the guilds whose routes differ from the given ones."""
+        return [
+            guild_id
+            for guild_id in self._guilds.keys() | guilds.keys()
+            if self._guilds.get(guild_id) != guilds.get(guild_id)
+        ]
+
+    def get(self, guild_id: int) -> GuildRoute | None:
+        return self._guilds.get(guild_id)
+
+    def update(self, guild_id: int, route: GuildRoute | None) -> None:
+        """Replace the routes of a single guild, without notifying listeners."""
+        previous = self._guilds.pop(guild_id, None)
+        if previous is not None:
+            for channel_id in previous.senders:
+                self._sender_guilds.pop(channel_id, None)
+        if route is not None:
+            self._guilds[guild_id] = route
+            self._sender_guilds.update(dict.fromkeys(route.senders, guild_id))
+        self.sender_channels = frozenset(self._sender_guilds)
+        self._invalidate()
+        self._touch(guild_id)
+
+    def _route(self, guild_id: int) -> GuildRoute:
+        return self._guilds.setdefault(guild_id, GuildRoute())
+
+    def set_receiver(self, guild_id: int, channel_id: int | None, *, nsfw: bool) -> None:
+        route = self._route(guild_id)
+        if nsfw:
+            route.nsfw_receiver = channel_id
+        else:
+            route.regular_receiver = channel_id
+        self._invalidate()
+        self._changed(guild_id)
+
+    def add_sender(self, guild_id: int, channel_id: int) -> None:
+        self._route(guild_id).senders.add(channel_id)
+        self._sender_guilds[channel_id] = guild_id
+        self.sender_channels = frozenset(self._sender_guilds)
+        self._changed(guild_id)
+
+    def remove_sender(self, guild_id: int, channel_id: int) -> None:
+        self._route(guild_id).senders.discard(channel_id)
+        self._sender_guilds.pop(channel_id, None)
+        self.sender_channels = frozenset(self._sender_guilds)
+        self._changed(guild_id)
+
+    def add_send_user(self, guild_id: int, user_id: int) -> None:
+        self._route(guild_id).send_users.add(user_id)
+        self._changed(guild_id)
+
+    def remove_send_user(self, guild_id: int, user_id: int) -> None:
+        self._route(guild_id).send_users.discard(user_id)
+        self._changed(guild_id)
+
+    def sender_guild(self, channel_id: int) -> int | None:
+        """Return the ID of the guild that registered the channel as a sender."""
+        return self._sender_guilds.get(channel_id)
+
+    def is_send_user(self, guild_id: int, user_id: int) -> bool:
+        route = self._guilds.get(guild_id)
+        return route is not None and user_id in route.send_users
+
+    def receivers(self, *, nsfw: bool, exclude_guild: int) -> list[tuple[int, int]]:
+        """Return the (guild_id, channel_id) pairs that should receive a forwarded message."""
+        receivers = self._receivers.get(nsfw)
+        if receivers is None:
+            receivers = self._receivers[nsfw] = tuple(
+                (guild_id, channel_id)
+                for guild_id, route in self._guilds.items()
+                if (channel_id := route.nsfw_receiver if nsfw else route.regular_receiver)
+                is not None
+            )
+        return [receiver for receiver in receivers if receiver[0] != exclude_guild]
+
+
+ROUTES = RoutingTable()
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+
+import discord
+from loguru import logger
+
+from wocardo.db.models import MediaHash
+from wocardo.media import HAS_PILLOW, perceptual_hash
+
+# Perceptual hashes are unsigned 64-bit integers but BIGINT columns are signed
+_UINT64 = 1 << 64
+_INT64_MAX = (1 << 63) - 1
+
+
+def _to_signed(value: int | None) -> int | None:
+    if value is None or value <= _INT64_MAX:
+        return value
+    return value - _UINT64
+
+
+def _to_unsigned(value: int | None) -> int | None:
+    if value is None or value >= 0:
+        return value
+    return value + _UINT64
+
+
+@dataclass(slots=True, frozen=True)
+class Fingerprint:
+    digest: str
+    phash: int | None
+
+
+def fingerprint(data: bytes | Path) -> Fingerprint:
+    phash = None
+    if HAS_PILLOW:
+        try:
+            phash = perceptual_hash(data)
+        except Exception:
+            logger.debug("Failed to compute the perceptual hash of an image")
+    if isinstance(data, Path):
+        # Spooled images are hashed a chunk at a time
+        with data.open("rb") as file:
+            return Fingerprint(hashlib.file_digest(file, "sha256").hexdigest(), phash)
+    return Fingerprint(hashlib.sha256(data).hexdigest(), phash)
+
+
+class DedupIndex:
+    """Remembers the images forwarded within a time window so reposts can be detected.
+
+    Images are matched by their SHA-256 digest, or by a perceptual hash within a Hamming
+    distance threshold. Fingerprints are persisted, with the most recent ones kept in a
+    bounded in-memory LRU that is searched first.
+    """
+
+    def __init__(self, *, window: float, threshold: int, maxsize: int) -> None:
+        self.window = window
+        self.threshold = threshold
+        self.maxsize = maxsize
+        # digest -> (perceptual hash, message ID)
+        self._entries: OrderedDict[str, tuple[int | None, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _cutoff(self) -> int:
+        """Return the oldest message ID still inside the window."""
+        return discord.utils.time_snowflake(discord.utils.utcnow() - timedelta(seconds=self.window))
+
+    async def load(self) -> int:
+        rows = (
+            await MediaHash.filter(message_id__gte=self._cutoff())
+            .order_by("-message_id")
+            .limit(self.maxsize)
+        )
+        for row in reversed(rows):
+            self._remember(Fingerprint(row.digest, _to_unsigned(row.phash)), row.message_id)
+        return len(rows)
+
+    def _remember(self, fp: Fingerprint, message_id: int) -> None:
+        self._entries[fp.digest] = (fp.phash, message_id)
+        self._entries.move_to_end(fp.digest)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _find(self, fp: Fingerprint, *, exclude: int, cutoff: int) -> int | None:
+        entry = self._entries.get(fp.digest)
+        if entry is not None and entry[1] >= cutoff and entry[1] != exclude:
+            self._entries.move_to_end(fp.digest)
+            return entry[1]
+
+        if fp.phash is None:
+            return None
+        for phash, message_id in reversed(self._entries.values()):
+            if phash is None or message_id < cutoff or message_id == exclude:
+                continue
+            if (phash ^ fp.phash).bit_count() <= self.threshold:
+                return message_id
+        return None
+
+    async def _find_persisted(
+        self, fingerprints: list[Fingerprint], *, exclude: int, cutoff: int
+    ) -> dict[str, int]:
+        """Return the latest message with each digest, by digest."""
+        rows = (
+            await MediaHash.filter(
+                digest__in=[fp.digest for fp in fingerprints], message_id__gte=cutoff
+            )
+            .exclude(message_id=exclude)
+            .order_by("message_id")
+            .values_list("digest", "message_id")
+        )
+        return dict(rows)
+
+    async def check(self, message_id: int, images: list[bytes | Path]) -> list[int | None]:
+        """Look for earlier messages with the same images.
+
+        Returns:
+            The ID of an earlier message with each image, or `None` for the new ones.
+            Unless every image was seen before, the images are remembered.
+        """
+        if not images:
+            return []
+
+        fingerprints = await asyncio.gather(*(asyncio.to_thread(fingerprint, i) for i in images))
+        cutoff = self._cutoff()
+
+        matches = [self._find(fp, exclude=message_id, cutoff=cutoff) for fp in fingerprints]
+        # The fingerprint may have been evicted from memory, or remembered by another process
+        missed = [fp for fp, match in zip(fingerprints, matches, strict=True) if match is None]
+        if missed:
+            persisted = await self._find_persisted(missed, exclude=message_id, cutoff=cutoff)
+            matches = [
+                persisted.get(fp.digest) if match is None else match
+                for fp, match in zip(fingerprints, matches, strict=True)
+            ]
+
+        if None not in matches:
+            return matches
+
+        for fp in fingerprints:
+            self._remember(fp, message_id)
+        await MediaHash.bulk_create(
+            [
+                MediaHash(digest=fp.digest, phash=_to_signed(fp.phash), message_id=message_id)
+                for fp in fingerprints
+            ]
+        )
+        return matches
+
+    async def prune(self, *, batch_size: int) -> int:
+        """Delete the persisted fingerprints that are out of the window."""
+        return await MediaHash.prune(self._cutoff(), batch_size=batch_size)
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+import discord
+from loguru import logger
+from tortoise.expressions import Q
+
+from wocardo.db.models import QueuedJob
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+
+class DeliveryQueue[J: QueuedJob]:
+    """Persistent queue of jobs waiting to be processed, like messages to forward.
+
+    Jobs are stored in the database until they are done, so pending ones are picked up
+    again when the bot restarts. Failed jobs are retried with an exponential backoff.
+
+    A shared queue is drained by polling the database instead, so jobs put by a gateway
+    process can be processed by separate worker processes. Workers claim a job by
+    locking it for `lease` seconds, after which a crashed worker's jobs are retried.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        model: type[J],
+        handler: Callable[[J], Awaitable[bool]],
+        *,
+        workers: int,
+        max_attempts: int,
+        retry_delay: float,
+        shared: bool = False,
+        poll_interval: float = 1,
+        lease: float = 300,
+    ) -> None:
+        self.model = model
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self.lease = lease
+        # Names the jobs in the logs, e.g. "delivery 123"
+        self._name = model.__name__.lower()
+
+        self._queue: asyncio.Queue[J] = asyncio.Queue()
+        # IDs of the jobs in the local queue, jobs put before the queue was started are
+        # resumed from the database instead
+        self._queued: set[int] = set()
+        self._started = False
+        # Jobs being handled by the workers
+        self._active = 0
+        self._tasks: list[asyncio.Task[None]] = []
+        self._retries: set[asyncio.TimerHandle] = set()
+
+    def __len__(self) -> int:
+        return self._queue.qsize() + len(self._retries)
+
+    async def start(self, owns: Callable[[J], bool] | None = None) -> int:
+        """Start the workers and resume pending jobs, returns how many were resumed.
+
+        Args:
+            owns: Selects the jobs this process should resume, when several processes
+                share the database but not the queue.
+        """
+        resumed = 0
+        self._started = True
+        if self.shared:
+            self._tasks.append(asyncio.create_task(self._poll(), name="delivery-poller"))
+        else:
+            for job in await self.model.all():
+                if (owns is None or owns(job)) and job.pk not in self._queued:
+                    self._enqueue(job)
+                    resumed += 1
+
+        self._tasks.extend(
+            asyncio.create_task(self._work(), name=f"delivery-worker-{i}")
+            for i in range(self.workers)
+        )
+        return resumed
+
+    async def stop(self) -> None:
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+
+        for task in self._tasks:
+            task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await asyncio.gather(*self._tasks)
+        self._tasks = []
+
+    async def put(self, job: J) -> None:
+        await job.save(force_create=True)
+        if not self.shared and self._started and job.pk not in self._queued:
+            self._enqueue(job)
+
+    def _enqueue(self, job: J) -> None:
+        self._queued.add(job.pk)
+        self._queue.put_nowait(job)
+
+    async def _claim(self, job: J) -> bool:
+        """Lock a job for this process, fails if another worker claimed it first."""
+        locked_until = discord.utils.utcnow() + timedelta(seconds=self.lease)
+        claimed = await self.model.filter(id=job.pk, locked_until=job.locked_until).update(
+            locked_until=locked_until
+        )
+        job.locked_until = locked_until
+        return claimed == 1
+
+    async def _poll(self) -> None:
+        while True:
+            claimed = 0
+            # Don't claim more than the workers can start on soon
+            free = self.workers - self._queue.qsize() - self._active
+            if free > 0:
+                jobs = (
+                    await self.model.filter(
+                        Q(locked_until=None) | Q(locked_until__lte=discord.utils.utcnow())
+                    )
+                    .order_by("id")
+                    .limit(free)
+                )
+                for job in jobs:
+                    if await self._claim(job):
+                        self._queue.put_nowait(job)
+                        claimed += 1
+
+            if not claimed:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _hold(self, job: J) -> None:
+        """Renew the lease of a claimed job while its handler runs."""
+        while True:
+            await asyncio.sleep(self.lease / 2)
+            if not await self._claim(job):
+                logger.warning(f"Lost the lease of {self._name} {job.pk} to another worker")
+                return
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._active += 1
+            lease = asyncio.create_task(self._hold(job)) if self.shared else None
+            try:
+                done = await self.handler(job)
+            except Exception:
+                logger.exception(f"Failed to process {self._name} {job.pk}")
+                done = False
+            finally:
+                self._queue.task_done()
+                self._active -= 1
+                if lease is not None:
+                    lease.cancel()
+
+            try:
+                if done:
+                    self._queued.discard(job.pk)
+                    await job.delete()
+                else:
+                    await self._retry(job)
+            except Exception:
+                # Left in the database, the job is resumed or its lease expires
+                logger.exception(f"Failed to update {self._name} {job.pk}")
+
+    async def _retry(self, job: J) -> None:
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            logger.error(f"Dropped {self._name} {job.pk} after {job.attempts} attempts")
+            self._queued.discard(job.pk)
+            await job.delete()
+            return
+
+        delay = self.retry_delay * 2 ** (job.attempts - 1)
+        logger.warning(f"Retrying {self._name} {job.pk} in {delay:.1f}s")
+        if self.shared:
+            # Stays locked until the retry is due, then any worker can pick it up
+            job.locked_until = discord.utils.utcnow() + timedelta(seconds=delay)
+            await job.save(update_fields=("attempts", "locked_until"))
+            return
+
+        def requeue() -> None:
+            self._retries.discard(handle)
+            self._queue.put_nowait(job)
+
+        # Scheduled first so the job is still retried if it can't be saved
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retries.add(handle)
+        await job.save(update_fields=("attempts",))
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePath
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    import discord
+
+try:
+    from PIL import Image  # pyright: ignore[reportMissingImports]
+except ImportError:
+    HAS_PILLOW = False
+else:
+    HAS_PILLOW = True
+
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+QUALITIES = (90, 80, 70, 60, 50, 40)
+MIN_SIDE = 256
+SCALE_STEP = 0.75
+
+
+def is_image(attachment: discord.Attachment) -> bool:
+    return PurePath(attachment.filename).suffix.lower() in IMAGE_EXTS
+
+
+def _open(data: bytes | Path) -> Image.Image:
+    return Image.open(data if isinstance(data, Path) else io.BytesIO(data))
+
+
+def recompress(data: bytes | Path, budget: int) -> bytes | None:
+    """Re-encode an image as WebP, lowering the quality and then the resolution until it
+    fits in the budget.
+
+    Runs in a worker process, returns `None` if the image can't be made small enough.
+    """
+    with _open(data) as original:
+        image = original.convert("RGBA" if "A" in original.getbands() else "RGB")
+
+    while True:
+        for quality in QUALITIES:
+            buffer = io.BytesIO()
+            image.save(buffer, format="WEBP", quality=quality, method=4)
+            if buffer.tell() <= budget:
+                return buffer.getvalue()
+
+        width, height = image.size
+        if min(width, height) * SCALE_STEP < MIN_SIDE:
+            return None
+        image = image.resize((int(width * SCALE_STEP), int(height * SCALE_STEP)))
+
+
+def perceptual_hash(data: bytes | Path) -> int:
+    """Compute the 64-bit difference hash of an image.
+
+    Similar images have hashes with a small Hamming distance.
+    """
+    with _open(data) as original:
+        image = original.convert("L").resize((9, 8))
+
+    pixels = image.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+class MediaRecompressor:
+    """Shrinks images that are over a receiver's upload limit.
+
+    Encoding runs in a process pool so it doesn't block the event loop. Destinations
+    sharing a limit reuse the same output through the `AttachmentBundle` they upload from.
+    """
+
+    def __init__(self, *, workers: int) -> None:
+        self.workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+
+    @staticmethod
+    def is_available() -> bool:
+        return HAS_PILLOW
+
+    @staticmethod
+    def supports(attachment: discord.Attachment) -> bool:
+        return is_image(attachment)
+
+    @staticmethod
+    def filename(attachment: discord.Attachment) -> str:
+        return str(PurePath(attachment.filename).with_suffix(".webp"))
+
+    async def recompress(
+        self, attachment: discord.Attachment, data: bytes | Path, budget: int
+    ) -> bytes | None:
+        """Shrink an image, read from its file by the worker process if it was spooled."""
+        if self._executor is None:
+            # Forking a process that runs threads can deadlock the child
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, recompress, data, budget
+            )
+        except Exception:
+            logger.exception(f"Failed to recompress attachment {attachment.id}")
+            return None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import contextlib
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Self
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from types import TracebackType
+
+    from tortoise.backends.base.client import BaseDBAsyncClient
+
+PREFIX = "wocardo"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+"""Upper bounds in seconds of the stage timer histogram buckets."""
+QUERY_METHODS = (
+    "execute_query",
+    "execute_query_dict",
+    "execute_insert",
+    "execute_many",
+    "execute_script",
+)
+# Loggers discord.py reports the 429s it retries to
+RATELIMIT_LOGGERS = {"discord.http": "rest", "discord.webhook.async_": "webhook"}
+
+type Labels = tuple[tuple[str, str], ...]
+
+
+def count_queries(connection: BaseDBAsyncClient, callback: Callable[[], object]) -> None:
+    """Call a callback for every query sent through a database connection."""
+
+    def wrap(method: Callable[..., Any]) -> Callable[..., Any]:
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+            callback()
+            return await method(*args, **kwargs)
+
+        return wrapper
+
+    for name in QUERY_METHODS:
+        setattr(connection, name, wrap(getattr(connection, name)))
+
+
+def _format_labels(labels: Labels, **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "max", "sum")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        index = bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.buckets[index] += 1
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self) -> Self:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+_NOOP = contextlib.nullcontext()
+
+
+class _RateLimitFilter(logging.Filter):
+    """Counts the 429s discord.py logs before retrying a request."""
+
+    def __init__(self, metrics: Metrics, client: str) -> None:
+        super().__init__()
+        self.metrics = metrics
+        self.client = client
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str) and "rate limited" in record.msg:
+            self.metrics.inc("ratelimited", client=self.client)
+        return True
+
+
+class Metrics:
+    """Counters, gauges and stage timers of the forwarding hot path.
+
+    Disabled by default, in which case recording is a no-op. When enabled, metrics are
+    served in the Prometheus text format and `snapshot()` can be called from jishaku,
+    e.g. `jsk py bot.metrics.snapshot()`.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._counters: Counter[tuple[str, Labels]] = Counter()
+        self._stages: dict[str, Histogram] = {}
+        self._gauges: dict[str, tuple[Callable[[], float | dict[str, float]], str]] = {}
+        self._runner: web.AppRunner | None = None
+
+    def enable(self) -> None:
+        self.enabled = True
+        for name, client in RATELIMIT_LOGGERS.items():
+            logging.getLogger(name).addFilter(_RateLimitFilter(self, client))
+
+    def inc(self, name: str, amount: int = 1, **labels: str) -> None:
+        if self.enabled:
+            self._counters[name, tuple(labels.items())] += amount
+
+    def time(self, stage: str) -> contextlib.AbstractContextManager[Any]:
+        """Time a stage of the forwarding pipeline."""
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self._stage(stage))
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if self.enabled:
+            self._stage(stage).observe(seconds)
+
+    def _stage(self, stage: str) -> Histogram:
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = Histogram()
+        return histogram
+
+    def gauge(
+        self, name: str, callback: Callable[[], float | dict[str, float]], *, label: str = ""
+    ) -> None:
+        """Register a gauge, read when metrics are collected.
+
+        Args:
+            label: Name of the label the keys are exported as, if the callback returns
+                values by key.
+        """
+        self._gauges[name] = (callback, label)
+
+    def instrument(self, connection: BaseDBAsyncClient) -> None:
+        """Count the queries sent through a database connection."""
+        count_queries(connection, lambda: self.inc("db_queries"))
+
+    def _read_gauges(self) -> dict[str, dict[str, float]]:
+        gauges: dict[str, dict[str, float]] = {}
+        for name, (callback, label) in self._gauges.items():
+            value = callback()
+            if not isinstance(value, dict):
+                gauges[name] = {"": value}
+            elif label:
+                gauges[name] = value
+            else:
+                gauges[name] = {"": sum(value.values())}
+        return gauges
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "counters": {
+                f"{name}{_format_labels(labels)}": value
+                for (name, labels), value in sorted(self._counters.items())
+            },
+            "gauges": {
+                name: values.get("", values) for name, values in self._read_gauges().items()
+            },
+            "stages": {
+                stage: {
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "max": histogram.max,
+                }
+                for stage, histogram in sorted(self._stages.items())
+            },
+        }
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines: list[str] = []
+
+        name = f"{PREFIX}_stage_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in sorted(self._stages.items()):
+            labels: Labels = (("stage", stage),)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.buckets, strict=True):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, le=str(bound))} {cumulative}")
+            lines.extend(
+                (
+                    f"{name}_bucket{_format_labels(labels, le='+Inf')} {histogram.count}",
+                    f"{name}_sum{_format_labels(labels)} {histogram.sum}",
+                    f"{name}_count{_format_labels(labels)} {histogram.count}",
+                )
+            )
+
+        previous = None
+        for counter, labels in sorted(self._counters):
+            name = f"{PREFIX}_{counter}_total"
+            if counter != previous:
+                lines.append(f"# TYPE {name} counter")
+                previous = counter
+            lines.append(f"{name}{_format_labels(labels)} {self._counters[counter, labels]}")
+
+        for gauge, values in self._read_gauges().items():
+            name = f"{PREFIX}_{gauge}"
+            label = self._gauges[gauge][1]
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(values.items()):
+                labels = ((label, key),) if label else ()
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, _: web.Request) -> web.Response:
+        return web.Response(
+            body=self.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def serve(self, host: str, port: int) -> None:
+        """Serve the metrics at /metrics."""
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+METRICS = Metrics()
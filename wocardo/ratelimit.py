@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from enum import IntEnum, StrEnum
+
+
+class Priority(IntEnum):
+    HIGH = 0
+    LOW = 1
+
+
+class Route(StrEnum):
+    WEBHOOK_SEND = "webhook_send"
+    WEBHOOK_DELETE = "webhook_delete"
+    CHANNEL_SEND = "channel_send"
+    CHANNEL_DELETE = "channel_delete"
+    REACTION = "reaction"
+
+
+# (requests, seconds) per bucket, kept slightly under the limits Discord reports
+LIMITS: dict[Route, tuple[int, float]] = {
+    Route.WEBHOOK_SEND: (5, 2),
+    Route.WEBHOOK_DELETE: (5, 1),
+    Route.CHANNEL_SEND: (5, 5),
+    Route.CHANNEL_DELETE: (5, 1),
+    Route.REACTION: (1, 0.25),
+}
+GLOBAL_LIMIT = (45, 1)
+
+# Reactions and deletes are cheap and time sensitive, don't let media sends hold them back
+PRIORITIES: dict[Route, Priority] = {
+    Route.WEBHOOK_SEND: Priority.LOW,
+    Route.CHANNEL_SEND: Priority.LOW,
+    Route.WEBHOOK_DELETE: Priority.HIGH,
+    Route.CHANNEL_DELETE: Priority.HIGH,
+    Route.REACTION: Priority.HIGH,
+}
+
+_counter = itertools.count()
+
+
+class Bucket:
+    """A sliding window rate limit whose waiters are released by priority."""
+
+    def __init__(self, limit: int, per: float) -> None:
+        self.limit = limit
+        self.per = per
+        self._calls: deque[float] = deque()
+        self._waiters: list[tuple[Priority, int, asyncio.Future[None]]] = []
+        self._pump: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def _delay(self) -> float:
+        now = time.monotonic()
+        while self._calls and self._calls[0] <= now - self.per:
+            self._calls.popleft()
+        if len(self._calls) < self.limit:
+            return 0
+        return self._calls[0] + self.per - now
+
+    async def acquire(self, priority: Priority) -> None:
+        if not self._waiters and self._delay() == 0:
+            self._calls.append(time.monotonic())
+            return
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(_counter), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self) -> None:
+        while self._waiters:
+            delay = self._delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # The waiter was cancelled
+                continue
+            self._calls.append(time.monotonic())
+            future.set_result(None)
+
+
+class RateLimitScheduler:
+    """Holds outbound requests back until their rate limit bucket has room.
+
+    Every request waits on its own bucket (per webhook or per channel) and then on a
+    process-wide bucket, so a burst against one destination only queues behind itself.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: dict[tuple[Route, int], Bucket] = {}
+        self._global = Bucket(*GLOBAL_LIMIT)
+
+    async def wait(self, route: Route, key: int) -> None:
+        bucket = self._buckets.get((route, key))
+        if bucket is None:
+            bucket = self._buckets[route, key] = Bucket(*LIMITS[route])
+
+        priority = PRIORITIES[route]
+        await bucket.acquire(priority)
+        await self._global.acquire(priority)
+
+    def depths(self) -> dict[str, int]:
+        """Return the number of requests waiting in every non-empty bucket."""
+        depths = {
+            f"{route}:{key}": len(bucket)
+            for (route, key), bucket in self._buckets.items()
+            if bucket
+        }
+        if self._global:
+            depths["global"] = len(self._global)
+        return depths
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import gzip
+import json
+import time
+from typing import TYPE_CHECKING, Any, TextIO
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+TRACED_EVENTS = frozenset({"MESSAGE_CREATE", "MESSAGE_DELETE", "MESSAGE_REACTION_ADD"})
+# Gateway frames are compact JSON, so these find the traced events without parsing
+_MARKERS = tuple(f'"t":"{event}"' for event in TRACED_EVENTS)
+
+
+def _open(path: Path, mode: str) -> TextIO:
+    if path.suffix == ".gz":
+        return gzip.open(path, f"{mode}t", encoding="utf-8")  # pyright: ignore[reportReturnType]
+    return path.open(mode, encoding="utf-8")
+
+
+class TraceRecorder:
+    """Records the gateway events handled by the network cog to a JSONL trace.
+
+    Every line has the event type, the Unix time it was received and the raw payload, so
+    a trace that is appended to across restarts stays in order. Traces ending in `.gz`
+    are compressed.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.recorded = 0
+        self._file: TextIO | None = None
+
+    def open(self) -> None:
+        self._file = _open(self.path, "a")
+
+    async def record(self, message: str) -> None:
+        """Listener for `on_socket_raw_receive`, which needs `enable_debug_events`.
+
+        Receives every gateway frame as raw JSON before it is parsed, so the frames of
+        other events are skipped without decoding them.
+        """
+        if self._file is None or not any(marker in message for marker in _MARKERS):
+            return
+        payload = json.loads(message)
+        event = payload.get("t")
+        if event not in TRACED_EVENTS:
+            return
+        entry = {"t": event, "at": round(time.time(), 3), "d": payload["d"]}
+        self._file.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_trace(path: Path) -> Iterator[tuple[str, float, dict[str, Any]]]:
+    """Yield the (event type, Unix time, payload) entries of a trace."""
+    with _open(path, "r") as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry["t"], entry["at"], entry["d"]
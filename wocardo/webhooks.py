@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import TYPE_CHECKING
+
+import discord
+from loguru import logger
+
+from wocardo.db.models import ChannelWebhook
+
+if TYPE_CHECKING:
+    from wocardo.bot import WocardoBot
+
+# Seconds during which the webhooks update caused by creating a webhook is ignored
+CREATED_UPDATE_WINDOW = 10
+
+
+class WebhookCache:
+    """Per-channel cache of the webhooks the bot forwards messages with.
+
+    Webhooks are persisted as id/token pairs so the cache survives restarts.
+    """
+
+    def __init__(self, bot: WocardoBot) -> None:
+        self.bot = bot
+        self._webhooks: dict[int, discord.Webhook] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        # When the cache created the webhook of a channel, by channel ID
+        self._created: dict[int, float] = {}
+        self._avatar: bytes | None = None
+        self._avatar_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._webhooks)
+
+    async def load(self) -> None:
+        self._webhooks = {
+            row.channel_id: discord.Webhook.partial(row.webhook_id, row.token, client=self.bot)
+            for row in await ChannelWebhook.all()
+        }
+
+    async def _get_avatar(self) -> bytes:
+        if self._avatar is None:
+            # Receivers without a webhook all need the avatar at once after a restart
+            async with self._avatar_lock:
+                if self._avatar is None:
+                    self._avatar = await self.bot.user.display_avatar.read()
+        return self._avatar
+
+    def get_cached(self, channel_id: int) -> discord.Webhook | None:
+        return self._webhooks.get(channel_id)
+
+    async def get(self, channel: discord.TextChannel) -> discord.Webhook:
+        webhook = self._webhooks.get(channel.id)
+        if webhook is not None:
+            return webhook
+
+        lock = self._locks.setdefault(channel.id, asyncio.Lock())
+        async with lock:
+            webhook = self._webhooks.get(channel.id)
+            if webhook is not None:
+                return webhook
+
+            webhook_name = self.bot.user.name
+            webhook = discord.utils.find(
+                lambda w: w.name == webhook_name and w.token is not None, await channel.webhooks()
+            )
+            if webhook is None:
+                webhook = await channel.create_webhook(
+                    name=webhook_name, avatar=await self._get_avatar()
+                )
+                self._created[channel.id] = time.monotonic()
+
+            self._webhooks[channel.id] = webhook
+            if webhook.token is not None:
+                await ChannelWebhook.update_or_create(
+                    channel_id=channel.id,
+                    defaults={"webhook_id": webhook.id, "token": webhook.token},
+                )
+
+        self._locks.pop(channel.id, None)
+        return webhook
+
+    async def updated(self, channel_id: int) -> None:
+        """Invalidate the webhook of a channel whose webhooks were updated.
+
+        The update that follows the cache creating the webhook is ignored.
+        """
+        created = self._created.pop(channel_id, None)
+        if created is not None and time.monotonic() - created < CREATED_UPDATE_WINDOW:
+            return
+        await self.invalidate(channel_id)
+
+    async def invalidate(self, channel_id: int) -> None:
+        if self._webhooks.pop(channel_id, None) is None:
+            return
+
+        logger.debug(f"Invalidated webhook of {channel_id=}")
+        await ChannelWebhook.filter(channel_id=channel_id).delete()